@@ -0,0 +1,557 @@
+# Virtual ESP32 fleet load generator and end-to-end ingest benchmark.
+#
+# Simulates N nodes speaking the topics of controllers/wokwi.py (temperature,
+# humidity, actuator command/status), namespaced per node, against the real
+# ingest stack (topic router, ingest queue, write-behind buffer) on its own
+# Flask app and database. Results are written as JSON so runs can be compared.
+#
+# Examples (from the repository root):
+#   python bench/fleet.py --nodes 100 --rate 1 --duration 30 --output results.json
+#   python bench/fleet.py --broker localhost:1883 --nodes 50   # real broker, e.g. mosquitto
+#   python bench/fleet.py --broker localhost:1883 --consumers 4 --nodes 200   # sharded ingest.py processes
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import queue
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SENSOR_TOPICS = {
+    "temperatura": "iot/sensor/temperatura",
+    "umidade": "iot/sensor/umidade",
+}
+ACTUATOR_TOPICS = {
+    "Ventilador": "iot/actuator/Ventilador",
+    "Mangueira_de_agua": "iot/actuator/Mangueira_de_agua",
+}
+
+
+def node_topics(node_id):
+    sensors = {name: f"{topic}/{node_id}" for name, topic in SENSOR_TOPICS.items()}
+    actuators = {
+        name: (f"{topic}/{node_id}/command", f"{topic}/{node_id}/status")
+        for name, topic in ACTUATOR_TOPICS.items()
+    }
+    return sensors, actuators
+
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered))) - 1))]
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "p50": round(rank(50), 3),
+        "p90": round(rank(90), 3),
+        "p99": round(rank(99), 3),
+        "max": round(ordered[-1], 3),
+    }
+
+
+class InProcessBroker:
+    """Broker stand-in: topic-filter subscriptions, delivered in order on one thread."""
+
+    def __init__(self):
+        from controllers.topic_router import TopicRouter
+
+        self._router = TopicRouter()
+        self._callbacks = {}
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def subscribe(self, topic_filter, callback):
+        subscription_id = len(self._callbacks)
+        self._callbacks[subscription_id] = callback
+        self._router.add_route(topic_filter, "subscription", subscription_id)
+
+    def publish(self, topic, payload):
+        self._queue.put((topic, payload.encode() if isinstance(payload, str) else payload))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="bench-broker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        while True:
+            message = self._queue.get()
+            if message is None:
+                return
+            topic, payload = message
+            for route in self._router.match(topic):
+                self._callbacks[route["id"]](topic, payload)
+
+
+class PahoBroker:
+    """Fleet side of a real broker: a single connection publishing for every node."""
+
+    def __init__(self, host, port):
+        import paho.mqtt.client as mqtt
+
+        self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"bench_fleet_{random.getrandbits(32):08x}")
+        self._client.connect(host, port, 60)
+
+    def subscribe(self, topic_filter, callback):
+        self._client.message_callback_add(topic_filter, lambda client, userdata, msg: callback(msg.topic, msg.payload))
+        self._client.subscribe(topic_filter)
+
+    def publish(self, topic, payload):
+        self._client.publish(topic, payload)
+
+    def start(self):
+        self._client.loop_start()
+
+    def stop(self):
+        self._client.loop_stop()
+        self._client.disconnect()
+
+
+class _Message:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class VirtualNode:
+    """One ESP32: publishes readings and answers commands on its status topic."""
+
+    def __init__(self, node_id, broker):
+        self.node_id = node_id
+        self.broker = broker
+        self.sensor_topics, self.actuator_topics = node_topics(node_id)
+        self.states = {name: False for name in self.actuator_topics}
+
+    def attach(self):
+        for name, (command_topic, _) in self.actuator_topics.items():
+            self.broker.subscribe(command_topic, lambda topic, payload, name=name: self.on_command(name, payload))
+
+    def on_command(self, name, payload):
+        # Same command/status format as controllers/wokwi.py
+        text = payload.decode().strip()
+        correlation_id = None
+        if text.startswith("{"):
+            data = json.loads(text)
+            text, correlation_id = data.get("command", ""), data.get("id")
+        self.states[name] = text.lower() in ("on", "ligar")
+        status = {"state": "ON" if self.states[name] else "OFF"}
+        if correlation_id:
+            status["id"] = correlation_id
+        self.broker.publish(self.actuator_topics[name][1], json.dumps(status))
+
+
+class Tracker:
+    """Matches published messages with the moment they reach state and the database."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = {}
+        self.sensor_topics = {}
+        self.state_ms = []
+        self.db_ms = []
+        self.command_ms = []
+        self.published = 0
+        self._flushed = []
+
+    def sensor_published(self, topic, value):
+        with self.lock:
+            self.sent[(topic, value)] = time.perf_counter()
+            self.published += 1
+
+    def command_acked(self, actuator_id, seconds):
+        with self.lock:
+            self.command_ms.append(seconds * 1000.0)
+
+    def state_applied(self, topic, payload):
+        now = time.perf_counter()
+        with self.lock:
+            started = self.sent.get((topic, payload))
+            if started is not None:
+                self.state_ms.append((now - started) * 1000.0)
+
+    def flush_hook(self, appended):
+        from models.iot.sensor_reading_model import SensorReading
+
+        self._flushed = [(row["sensor_id"], row["value"]) for row in appended.get(SensorReading, ())]
+
+    def flush_done(self, seconds, rows, ok):
+        now = time.perf_counter()
+        flushed, self._flushed = self._flushed, []
+        if not ok:
+            return
+        with self.lock:
+            for sensor_id, value in flushed:
+                topic = self.sensor_topics.get(sensor_id)
+                started = self.sent.pop((topic, f"{value:.1f}"), None)
+                if started is not None:
+                    self.db_ms.append((now - started) * 1000.0)
+
+
+def cpu_usage():
+    if resource is None:
+        return {"cpu_seconds": time.process_time(), "max_rss_mb": None}
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    divisor = 1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0
+    return {"cpu_seconds": usage.ru_utime + usage.ru_stime, "max_rss_mb": round(usage.ru_maxrss / divisor, 1)}
+
+
+def build_stack(database_uri, nodes):
+    from app import create_app
+    from models.db import db
+    from models.iot.sensor_model import Sensor
+    from models.iot.actuator_model import Actuator
+    from controllers import shared
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": database_uri})
+    sensor_topics = {}
+    with app.app_context():
+        db.create_all()
+        for node in nodes:
+            for name, topic in node.sensor_topics.items():
+                sensor = Sensor.save_sensor(f"{name} {node.node_id}", topic, "")
+                sensor_topics[sensor.id] = topic
+            for name, (command_topic, status_topic) in node.actuator_topics.items():
+                Actuator.save_actuator(f"{name} {node.node_id}", command_topic, status_topic, False, "")
+        shared.load_routes()
+    return app, sensor_topics
+
+
+def register_bench_actuators(nodes):
+    """Add every node's actuators to the dashboard actuators, so commands go through send_actuator_command.
+
+    Returns {(node_id, actuator name): actuator id}.
+    """
+    from controllers import shared
+
+    actuator_ids = {}
+    for node in nodes:
+        for name, (command_topic, status_topic) in node.actuator_topics.items():
+            actuator_id = actuator_ids[(node.node_id, name)] = f"bench_{name}_{node.node_id}"
+            shared.get_state_store().publish("actuator", actuator_id, {
+                "id": actuator_id,
+                "name": f"{name} {node.node_id}",
+                "command_topic": command_topic,
+                "status_topic": status_topic,
+                "state": "Desligado",
+            })
+    return actuator_ids
+
+
+def command_totals(actuator_ids):
+    """The command tracker's counters, summed over the bench actuators."""
+    from controllers import shared
+
+    stats = shared.command_tracker.stats()
+    totals = {"sent": 0, "acked": 0, "retries": 0, "timeouts": 0}
+    for actuator_id in actuator_ids:
+        for field in totals:
+            totals[field] += stats.get(actuator_id, {}).get(field, 0)
+    totals["pending"] = sum(1 for command in shared.command_tracker.pending() if command["actuator_id"] in actuator_ids)
+    return totals
+
+
+def count_readings(app):
+    from models.db import db
+    from models.iot.sensor_reading_model import SensorReading
+
+    with app.app_context():
+        return db.session.query(SensorReading.id).count()
+
+
+def run_sharded(args):
+    """Publish through a real broker to `args.consumers` ingest.py processes in one shared group.
+
+    Per-message latency is not observable across processes, so this mode
+    reports persisted throughput from the row count in the database.
+    """
+    os.environ.setdefault("IOT_ROLE", "all")
+    host, _, port = args.broker.partition(":")
+    broker = PahoBroker(host, int(port or 1883))
+    nodes = [VirtualNode(f"esp32-{index:04d}", broker) for index in range(args.nodes)]
+    tmpdir = tempfile.mkdtemp(prefix="iot-bench-")
+    database_uri = args.database_uri or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    app, _sensor_topics = build_stack(database_uri, nodes)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, IOT_DATABASE_URL=database_uri, IOT_MQTT_HOST=host, IOT_MQTT_PORT=port or "1883",
+               IOT_INGEST_WORKERS=str(args.workers))
+    output = None if args.verbose else subprocess.DEVNULL
+    supervisor = subprocess.Popen(
+        [sys.executable, os.path.join(root, "ingest.py"), "--consumers", str(args.consumers),
+         "--group", f"iot-bench-{os.getpid()}"],
+        env=env, cwd=root, stdout=output, stderr=output,
+    )
+    broker.start()
+    time.sleep(args.startup_wait)  # consumers connect and subscribe
+
+    sensor_targets = [topic for node in nodes for topic in node.sensor_topics.values()]
+    total_rate = args.rate * len(sensor_targets)
+    published = 0
+    cpu_before = cpu_usage()
+    started = time.perf_counter()
+    try:
+        while True:
+            elapsed = time.perf_counter() - started
+            if elapsed >= args.duration:
+                break
+            due = int(elapsed * total_rate) - published
+            for _ in range(due):
+                broker.publish(sensor_targets[published % len(sensor_targets)], f"{float(published + 1):.1f}")
+                published += 1
+            time.sleep(0.001)
+        published_for = time.perf_counter() - started
+
+        # Drain: wait until every reading is in the database or the count stops moving
+        deadline = time.perf_counter() + args.drain_timeout
+        persisted, last_change = 0, time.perf_counter()
+        while time.perf_counter() < deadline and persisted < published:
+            time.sleep(0.25)
+            count = count_readings(app)
+            if count != persisted:
+                persisted, last_change = count, time.perf_counter()
+            elif time.perf_counter() - last_change > 5:
+                break
+        total_time = last_change - started
+    finally:
+        broker.stop()
+        supervisor.terminate()
+        supervisor.wait()
+    cpu_after = cpu_usage()
+
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "nodes": args.nodes,
+            "rate_per_sensor": args.rate,
+            "duration": args.duration,
+            "workers": args.workers,
+            "consumers": args.consumers,
+            "broker": args.broker,
+            "database": database_uri.split(":", 1)[0],
+        },
+        "messages": {
+            "published": published,
+            "persisted": persisted,
+        },
+        "throughput_per_s": {
+            "published": round(published / published_for, 1),
+            "persisted": round(persisted / total_time, 1),
+        },
+        "resources": {
+            # The publisher only; the consumers are separate processes
+            "publisher_cpu_seconds": round(cpu_after["cpu_seconds"] - cpu_before["cpu_seconds"], 3),
+        },
+    }
+
+
+def run(args):
+    # Read by controllers.shared at import time
+    os.environ.setdefault("IOT_ROLE", "all")
+    os.environ["IOT_INGEST_WORKERS"] = str(args.workers)
+    from controllers import shared
+
+    if args.broker:
+        host, _, port = args.broker.partition(":")
+        broker = PahoBroker(host, int(port or 1883))
+    else:
+        broker = InProcessBroker()
+
+    nodes = [VirtualNode(f"esp32-{index:04d}", broker) for index in range(args.nodes)]
+    tmpdir = tempfile.mkdtemp(prefix="iot-bench-")
+    database_uri = args.database_uri or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    app, sensor_topics = build_stack(database_uri, nodes)
+    actuator_ids = register_bench_actuators(nodes)
+
+    tracker = Tracker()
+    tracker.sensor_topics = sensor_topics
+    process_message = shared.process_message
+    on_ack_latency = shared.command_tracker.on_ack_latency
+
+    def traced_ack_latency(actuator_id, seconds):
+        on_ack_latency(actuator_id, seconds)
+        tracker.command_acked(actuator_id, seconds)
+
+    def traced_process_message(topic, payload, received_at):
+        process_message(topic, payload, received_at)
+        tracker.state_applied(topic, payload)
+
+    # The ingest queue resolves process_message at call time
+    shared.process_message = traced_process_message
+    shared.write_buffer.add_flush_hook(tracker.flush_hook)
+    shared.write_buffer.add_flush_listener(tracker.flush_done)
+    shared.command_tracker.on_ack_latency = traced_ack_latency
+
+    if args.broker:
+        # The server side is the application's own client, subscribed by on_connect
+        shared.mqtt_client.connect(host, int(port or 1883), 60)
+        shared.mqtt_client.loop_start()
+    else:
+        # Commands leave through the stand-in instead of the application's client
+        shared.command_tracker.publish = broker.publish
+        for topic in shared.topic_router.topics():
+            broker.subscribe(topic, lambda topic, payload: shared.on_message(None, None, _Message(topic, payload)))
+    for node in nodes:
+        node.attach()
+
+    shared.write_buffer.start()
+    shared.ingest_queue.start()
+    shared.command_tracker.start()
+    broker.start()
+    time.sleep(1.0 if args.broker else 0.1)  # let subscriptions settle
+
+    sensor_targets = [(topic, node) for node in nodes for topic in node.sensor_topics.values()]
+    actuator_targets = [(node, actuator_ids[(node.node_id, name)]) for node in nodes for name in node.actuator_topics]
+    total_rate = args.rate * len(sensor_targets)
+    command_interval = 1.0 / args.command_rate if args.command_rate > 0 else None
+
+    output = open(os.devnull, "w") if not args.verbose else sys.stdout
+    sequence = 0
+    cpu_before = cpu_usage()
+    started = time.perf_counter()
+    next_command = started
+    with contextlib.redirect_stdout(output):
+        while True:
+            now = time.perf_counter()
+            elapsed = now - started
+            if elapsed >= args.duration:
+                break
+            # Publish every reading that is due by now, round-robin over the fleet
+            due = int(elapsed * total_rate) - sequence
+            for _ in range(due):
+                topic, _node = sensor_targets[sequence % len(sensor_targets)]
+                sequence += 1
+                # Unique values let each reading be matched to its database row
+                value = f"{float(sequence):.1f}"
+                tracker.sensor_published(topic, value)
+                broker.publish(topic, value)
+            if command_interval and now >= next_command:
+                # The same path as a dashboard command: tracked until the node acknowledges it
+                node, actuator_id = random.choice(actuator_targets)
+                if not shared.command_tracker.pending(actuator_id):
+                    with shared.data_lock:
+                        _key, actuator = shared.find_actuator(actuator_id)
+                        shared.send_actuator_command(actuator_id, "OFF" if actuator["state"] == "Ligado" else "ON", "bench")
+                next_command = now + command_interval
+            time.sleep(0.001)
+
+        published_for = time.perf_counter() - started
+        # Drain: wait for the queue, the write-behind buffer and the pending commands to empty
+        deadline = time.perf_counter() + args.drain_timeout
+        while time.perf_counter() < deadline:
+            if (not shared.ingest_queue.depth() and not shared.write_buffer.pending_count()
+                    and not shared.command_tracker.pending()):
+                break
+            time.sleep(0.05)
+        broker.stop()
+        shared.command_tracker.stop()
+        shared.ingest_queue.stop()
+        shared.write_buffer.stop()
+        if args.broker:
+            shared.mqtt_client.loop_stop()
+    total_time = time.perf_counter() - started
+    cpu_after = cpu_usage()
+    cpu_seconds = cpu_after["cpu_seconds"] - cpu_before["cpu_seconds"]
+    commands = command_totals(set(actuator_ids.values()))
+
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "nodes": args.nodes,
+            "rate_per_sensor": args.rate,
+            "command_rate": args.command_rate,
+            "duration": args.duration,
+            "workers": args.workers,
+            "broker": args.broker or "in-process",
+            "database": database_uri.split(":", 1)[0],
+        },
+        "messages": {
+            "published": tracker.published,
+            "applied_to_state": len(tracker.state_ms),
+            "persisted": len(tracker.db_ms),
+            "commands_sent": commands["sent"],
+            "commands_acked": commands["acked"],
+            "command_retries": commands["retries"],
+            "command_timeouts": commands["timeouts"],
+            "commands_pending": commands["pending"],
+        },
+        "throughput_per_s": {
+            "published": round(tracker.published / published_for, 1),
+            "applied_to_state": round(len(tracker.state_ms) / total_time, 1),
+            "persisted": round(len(tracker.db_ms) / total_time, 1),
+        },
+        "latency_ms": {
+            "publish_to_state": percentiles(tracker.state_ms),
+            "publish_to_db": percentiles(tracker.db_ms),
+            "command_round_trip": percentiles(tracker.command_ms),
+        },
+        "resources": {
+            "cpu_seconds": round(cpu_seconds, 3),
+            "cpu_percent": round(100.0 * cpu_seconds / total_time, 1),
+            "max_rss_mb": cpu_after["max_rss_mb"],
+        },
+        "components": {
+            "ingest_queue": shared.ingest_queue.stats(),
+            "write_buffer": shared.write_buffer.stats(),
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the IoT ingest path with a virtual ESP32 fleet.")
+    parser.add_argument("--nodes", type=int, default=50, help="number of virtual ESP32 nodes")
+    parser.add_argument("--rate", type=float, default=1.0, help="readings per second per sensor (2 sensors per node)")
+    parser.add_argument("--command-rate", type=float, default=5.0, help="actuator commands per second (0 disables)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    parser.add_argument("--workers", type=int, default=2, help="ingest workers (IOT_INGEST_WORKERS)")
+    parser.add_argument("--broker", help="host[:port] of a real MQTT broker; default is an in-process stand-in")
+    parser.add_argument("--database-uri", help="SQLAlchemy URI; default is a temporary SQLite file")
+    parser.add_argument("--drain-timeout", type=float, default=30.0, help="max seconds to wait for the backlog")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--verbose", action="store_true", help="keep the application's per-message logging")
+    parser.add_argument("--consumers", type=int, default=0,
+                        help="run ingest.py with this many shared-subscription consumers (needs --broker)")
+    parser.add_argument("--startup-wait", type=float, default=5.0,
+                        help="seconds to let the --consumers processes connect before publishing")
+    args = parser.parse_args(argv)
+    if args.consumers and not args.broker:
+        parser.error("--consumers needs --broker: shared subscriptions are a broker feature")
+
+    results = run_sharded(args) if args.consumers else run(args)
+    encoded = json.dumps(results, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(encoded + "\n")
+        print(f"📈 Resultados salvos em {args.output}")
+    else:
+        print(encoded)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session
-from controllers.shared import devices, data_lock, mqtt_client
+from controllers.shared import mqtt_client, topic_router, register_actuator_route, registry_changed
 import uuid
 import time
 import paho.mqtt.client as mqtt
@@ -41,12 +41,10 @@ def register_actuator_page():
                 flash("Já existe um atuador com este tópico de status", "warning")
                 return render_template("register_actuator.html")
 
-        Actuator.save_actuator(actuator_name, topic_command, topic_status, is_active, unit )
-        
-        # Subscribe to status topic if provided
-        if topic_status:
-            mqtt_client.subscribe(topic_status)
-            print(f"🔔 Subscribed to actuator status topic: {topic_status}")
+        actuator = Actuator.save_actuator(actuator_name, topic_command, topic_status, is_active, unit )
+        register_actuator_route(actuator)
+        # Subscribes to the status topic, if any, in the ingest process
+        registry_changed()
         
         flash(f"Atuador '{actuator_name}' registrado com sucesso!", "success")
         return redirect(url_for("actuator_main.manage_actuators_page"))
@@ -79,16 +77,10 @@ def edit_actuator_page(actuator_id):
             flash("Nome e tópico de comando são obrigatórios", "error")
             return render_template("register_actuator.html")
         
-        if actuator.topic_status and actuator.topic_status != topic_status:
-            mqtt_client.unsubscribe(actuator.topic_status)
-            print(f"🔕 Unsubscribed from old status topic: {actuator.topic_status}")
-        
         Actuator.update_actuator(actuator_id, actuator_name, topic_command, topic_status, is_active, unit )
-        
-        # Subscribe to new status topic if provided
-        if topic_status:
-            mqtt_client.subscribe(topic_status)
-            print(f"🔔 Subscribed to new status topic: {topic_status}")
+        register_actuator_route(actuator)
+        # Moves the subscription to the new status topic in the ingest process
+        registry_changed()
         
         flash("Atuador atualizado com sucesso!", "success")
         return redirect(url_for("actuator_main.manage_actuators_page"))
@@ -124,11 +116,9 @@ def delete_actuator(actuator_id):
         flash("Atuador não encontrado", "error")
         return redirect(url_for("actuator_main.manage_actuators_page"))
     
-    if actuator.topic_status:
-        mqtt_client.unsubscribe(actuator.topic_status)
-        print(f"🔕 Unsubscribed from status topic: {actuator.topic_status}")
-    
     Actuator.delete_actuator(actuator_id)
+    topic_router.remove_route("actuator", actuator_id)
+    registry_changed()
     
     flash(f"Atuador '{actuator.name}' removido com sucesso", "success")
     print(f"🗑️ Deleted actuator: {actuator_id}")
@@ -0,0 +1,81 @@
+import json
+import queue
+import threading
+
+SSE_HEARTBEAT_SECONDS = 15
+SSE_RETRY_MS = 3000
+
+
+class Broadcaster:
+    """Fans out device change events to every connected Server-Sent Events client.
+
+    Each event is serialized once and handed to the per-client queues, so the
+    cost of a change does not depend on how the clients render it. A client
+    whose queue fills up is disconnected; the browser reconnects and
+    resynchronizes from `/api/device_data`.
+    """
+
+    def __init__(self, client_queue_size=256):
+        self.client_queue_size = client_queue_size
+        self._lock = threading.Lock()
+        self._clients = set()
+        self._counters = {"events": 0, "dropped_clients": 0}
+
+    def subscribe(self):
+        client = queue.Queue(maxsize=self.client_queue_size)
+        with self._lock:
+            self._clients.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def client_count(self):
+        return len(self._clients)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["clients"] = len(self._clients)
+        return stats
+
+    def publish(self, event, data):
+        message = f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        with self._lock:
+            self._counters["events"] += 1
+            clients = list(self._clients)
+        for client in clients:
+            try:
+                client.put_nowait(message)
+            except queue.Full:
+                self._drop(client)
+
+    def _drop(self, client):
+        self.unsubscribe(client)
+        with self._lock:
+            self._counters["dropped_clients"] += 1
+        # Make room for the sentinel that ends the client's stream
+        while True:
+            try:
+                client.get_nowait()
+            except queue.Empty:
+                break
+        client.put_nowait(None)
+
+    def stream(self, client, heartbeat=SSE_HEARTBEAT_SECONDS):
+        """Generator producing the SSE body for one subscribed client."""
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            while True:
+                try:
+                    message = client.get(timeout=heartbeat)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(client)
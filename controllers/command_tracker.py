@@ -0,0 +1,198 @@
+import heapq
+import json
+import threading
+import time
+import uuid
+from collections import deque
+
+COMMAND_PENDING = "pending"
+COMMAND_ACKED = "acked"
+COMMAND_TIMEOUT = "timeout"
+COMMAND_UNTRACKED = "untracked"
+
+
+def command_payload(mqtt_payload, correlation_id):
+    """MQTT payload of a tracked command: `{"command": "ON", "id": "<correlation id>"}`."""
+    return json.dumps({"command": mqtt_payload, "id": correlation_id}, separators=(",", ":"))
+
+
+def parse_status_payload(payload):
+    """Return (is_active, correlation_id) for a status message.
+
+    Devices answer either `{"state": "ON", "id": "<correlation id>"}` or, like
+    the original firmware, a plain `ON`/`OFF` (correlation id None).
+    """
+    if payload.startswith("{"):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            state = str(data.get("state", "")).strip().upper()
+            return state == "ON", data.get("id")
+    return payload.strip().upper() == "ON", None
+
+
+class CommandTracker:
+    """Tracks actuator commands until the device confirms them on its status topic.
+
+    A command is acknowledged by a status carrying its correlation id or, for
+    devices that only answer `ON`/`OFF`, by the first status reporting the
+    requested state. Unacknowledged commands are published again after
+    `ack_timeout * backoff ** attempt` seconds, up to `max_retries` times,
+    then given up. `on_resolved(command)` runs when a command is acked or
+    times out; the measured command-to-ack latency is kept per actuator.
+    """
+
+    def __init__(self, publish, ack_timeout=5.0, max_retries=3, backoff=2.0, on_resolved=None, on_ack_latency=None):
+        self.publish = publish
+        self.ack_timeout = ack_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.on_resolved = on_resolved
+        self.on_ack_latency = on_ack_latency
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._by_status_topic = {}
+        self._deadlines = []
+        self._stats = {}
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="command-tracker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def send(self, actuator, mqtt_payload, correlate=True):
+        """Publish `mqtt_payload` (ON/OFF) to `actuator` and track it. Returns the command."""
+        correlation_id = uuid.uuid4().hex[:12]
+        payload = command_payload(mqtt_payload, correlation_id) if correlate else mqtt_payload
+        now = time.monotonic()
+        command = {
+            "id": correlation_id,
+            "actuator_id": actuator["id"],
+            "command_topic": actuator["command_topic"],
+            "status_topic": actuator.get("status_topic"),
+            "target_active": mqtt_payload == "ON",
+            "payload": payload,
+            "status": COMMAND_PENDING,
+            "attempts": 1,
+            "sent_at": now,
+            "ack_ms": None,
+        }
+        self.publish(command["command_topic"], payload)
+        with self._cond:
+            self._actuator_stats(command["actuator_id"])["sent"] += 1
+            if not command["status_topic"]:
+                # Nothing to listen to: the command can never be confirmed
+                command["status"] = COMMAND_UNTRACKED
+                return command
+            self._pending[correlation_id] = command
+            self._by_status_topic.setdefault(command["status_topic"], deque()).append(correlation_id)
+            heapq.heappush(self._deadlines, (now + self.ack_timeout, correlation_id))
+            self._cond.notify()
+        return command
+
+    def acknowledge(self, status_topic, is_active, correlation_id=None):
+        """Resolve the command confirmed by a status message. Returns it, or None."""
+        now = time.monotonic()
+        with self._cond:
+            queued = self._by_status_topic.get(status_topic)
+            if not queued:
+                return None
+            if correlation_id is None:
+                correlation_id = next(
+                    (pending_id for pending_id in queued if self._pending[pending_id]["target_active"] == is_active),
+                    None,
+                )
+            command = self._pending.get(correlation_id)
+            if command is None or command["status_topic"] != status_topic:
+                return None
+            self._forget(command)
+            command["status"] = COMMAND_ACKED
+            command["ack_ms"] = (now - command["sent_at"]) * 1000.0
+            stats = self._actuator_stats(command["actuator_id"])
+            stats["acked"] += 1
+            stats["total_ack_ms"] += command["ack_ms"]
+            stats["last_ack_ms"] = command["ack_ms"]
+            stats["max_ack_ms"] = max(stats["max_ack_ms"], command["ack_ms"])
+        if self.on_ack_latency:
+            self.on_ack_latency(command["actuator_id"], command["ack_ms"] / 1000.0)
+        if self.on_resolved:
+            self.on_resolved(command)
+        return command
+
+    def pending(self, actuator_id=None):
+        with self._cond:
+            return [dict(command) for command in self._pending.values()
+                    if actuator_id is None or command["actuator_id"] == actuator_id]
+
+    def stats(self):
+        """Per-actuator ack counters and latencies."""
+        with self._cond:
+            stats = {actuator_id: dict(values) for actuator_id, values in self._stats.items()}
+        for values in stats.values():
+            values["avg_ack_ms"] = values["total_ack_ms"] / values["acked"] if values["acked"] else None
+        return stats
+
+    def _actuator_stats(self, actuator_id):
+        stats = self._stats.get(actuator_id)
+        if stats is None:
+            stats = self._stats[actuator_id] = {
+                "sent": 0, "acked": 0, "retries": 0, "timeouts": 0,
+                "total_ack_ms": 0.0, "last_ack_ms": None, "max_ack_ms": 0.0,
+            }
+        return stats
+
+    def _forget(self, command):
+        # Caller holds self._cond; stale heap entries are skipped in _run
+        self._pending.pop(command["id"], None)
+        queued = self._by_status_topic.get(command["status_topic"])
+        if queued is not None:
+            queued.remove(command["id"])
+            if not queued:
+                del self._by_status_topic[command["status_topic"]]
+
+    def _run(self):
+        while self._running:
+            retries, expired = [], []
+            with self._cond:
+                now = time.monotonic()
+                while self._deadlines and self._deadlines[0][0] <= now:
+                    _, correlation_id = heapq.heappop(self._deadlines)
+                    command = self._pending.get(correlation_id)
+                    if command is None:
+                        continue
+                    if command["attempts"] > self.max_retries:
+                        self._forget(command)
+                        command["status"] = COMMAND_TIMEOUT
+                        self._actuator_stats(command["actuator_id"])["timeouts"] += 1
+                        expired.append(command)
+                    else:
+                        delay = self.ack_timeout * self.backoff ** command["attempts"]
+                        command["attempts"] += 1
+                        self._actuator_stats(command["actuator_id"])["retries"] += 1
+                        heapq.heappush(self._deadlines, (now + delay, correlation_id))
+                        retries.append(command)
+                if not retries and not expired:
+                    timeout = self._deadlines[0][0] - now if self._deadlines else None
+                    self._cond.wait(timeout if timeout is None else max(timeout, 0.01))
+                    continue
+            for command in retries:
+                print(f"🔁 Reenviando comando {command['id']} (tentativa {command['attempts']})")
+                self.publish(command["command_topic"], command["payload"])
+            for command in expired:
+                print(f"⏱️ Comando {command['id']} sem confirmação de {command['actuator_id']}")
+                if self.on_resolved:
+                    self.on_resolved(command)
@@ -0,0 +1,88 @@
+import csv
+import datetime
+import io
+import json
+import zlib
+from sqlalchemy import select
+from models.iot.sensor_model import Sensor
+from models.iot.sensor_reading_model import SensorReading
+from models.iot.command_model import CommandLog
+
+EXPORT_BATCH_SIZE = 5000
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def readings_query(sensor_id=None, start=None, end=None):
+    query = (
+        select(SensorReading.id, SensorReading.sensor_id, Sensor.name.label("sensor_name"),
+               SensorReading.timestamp, SensorReading.value, SensorReading.anomaly)
+        .join(Sensor, Sensor.id == SensorReading.sensor_id)
+    )
+    if sensor_id is not None:
+        query = query.where(SensorReading.sensor_id == sensor_id)
+    if start is not None:
+        query = query.where(SensorReading.timestamp >= start)
+    if end is not None:
+        query = query.where(SensorReading.timestamp < end)
+    # Primary key order streams straight off the index, without a sort over the whole result
+    return query.order_by(SensorReading.id)
+
+
+def commands_query(actuator_id=None, user=None, start=None, end=None):
+    query = select(CommandLog.__table__)
+    if actuator_id:
+        query = query.where(CommandLog.actuator_id == actuator_id)
+    if user:
+        query = query.where(CommandLog.user == user)
+    if start is not None:
+        query = query.where(CommandLog.timestamp >= start)
+    if end is not None:
+        query = query.where(CommandLog.timestamp < end)
+    return query.order_by(CommandLog.id)
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime.datetime) else value
+
+
+def _encode_csv(columns, rows, header):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(columns)
+    writer.writerows([[_plain(value) for value in row] for row in rows])
+    return buffer.getvalue()
+
+
+def _encode_ndjson(columns, rows, header):
+    return "".join(json.dumps(dict(zip(columns, map(_plain, row))), ensure_ascii=False) + "\n" for row in rows)
+
+
+def stream_export(engine, query, export_format, compress=False):
+    """Yield `query` encoded as CSV or NDJSON, optionally gzipped, one fetch batch at a time.
+
+    The query runs on its own connection with a server-side cursor, so only
+    EXPORT_BATCH_SIZE rows are held in memory whatever the size of the export.
+    The connection is released when the generator finishes or the client
+    disconnects. Takes the engine rather than the session, so it can run
+    after the request context is gone.
+    """
+    encode = _encode_csv if export_format == "csv" else _encode_ndjson
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE).execute(query)
+        columns = list(result.keys())
+        header = True
+        for rows in result.partitions():
+            chunk = encode(columns, rows, header).encode("utf-8")
+            header = False
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+        if header and export_format == "csv":
+            # Empty export: still send the header so the file is well-formed
+            chunk = encode(columns, [], True).encode("utf-8")
+            yield compressor.compress(chunk) if compressor is not None else chunk
+    if compressor is not None:
+        yield compressor.flush()
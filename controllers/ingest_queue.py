@@ -0,0 +1,162 @@
+import threading
+import zlib
+from collections import deque
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DROP_PRIORITY = "drop_priority"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_PRIORITY)
+
+
+class _Shard:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.cond = threading.Condition()
+        # priority -> deque of messages; plain FIFO policies only use level 0
+        self.levels = {}
+        self.size = 0
+
+    def push(self, priority, message):
+        self.levels.setdefault(priority, deque()).append(message)
+        self.size += 1
+
+    def pop_highest(self):
+        for priority in sorted(self.levels, reverse=True):
+            level = self.levels[priority]
+            if level:
+                self.size -= 1
+                return level.popleft()
+        return None
+
+    def drop_lowest(self, below=None):
+        """Drop the oldest message of the lowest non-empty priority (< `below`)."""
+        for priority in sorted(self.levels):
+            if below is not None and priority >= below:
+                return False
+            level = self.levels[priority]
+            if level:
+                level.popleft()
+                self.size -= 1
+                return True
+        return False
+
+
+class IngestQueue:
+    """Bounded queue between the paho network thread and the ingest workers.
+
+    The MQTT callback only decodes the message and calls `put`; a pool of
+    workers runs `handler(topic, payload, received_at)`. Messages are sharded by
+    topic so each topic is always handled by the same worker, in order.
+
+    When a shard is full the overflow policy decides what happens:
+    - "block": `put` waits for space (back-pressure into the paho loop);
+    - "drop_oldest": the oldest queued message is discarded;
+    - "drop_priority": the oldest message of the lowest priority below the
+      incoming one is discarded, otherwise the incoming message is.
+    """
+
+    def __init__(self, handler, workers=2, max_size=10000, overflow_policy=OVERFLOW_DROP_OLDEST, priority=None):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Política de overflow inválida: {overflow_policy}")
+        self.handler = handler
+        self.overflow_policy = overflow_policy
+        self.priority = priority
+        self.workers = max(1, workers)
+        shard_size = max(1, max_size // self.workers)
+        self._shards = [_Shard(shard_size) for _ in range(self.workers)]
+        self._threads = []
+        self._running = False
+        self._counters_lock = threading.Lock()
+        self._counters = {
+            "enqueued": 0,
+            "processed": 0,
+            "dropped": 0,
+            "blocked": 0,
+            "handler_errors": 0,
+            "max_depth": 0,
+        }
+
+    def start(self):
+        if self._threads:
+            return
+        self._running = True
+        for index, shard in enumerate(self._shards):
+            thread = threading.Thread(target=self._run, args=(shard,), name=f"ingest-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        """Stop the workers after they drain what is already queued."""
+        self._running = False
+        for shard in self._shards:
+            with shard.cond:
+                shard.cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+
+    def depth(self):
+        return sum(shard.size for shard in self._shards)
+
+    def stats(self):
+        with self._counters_lock:
+            stats = dict(self._counters)
+        stats["depth"] = self.depth()
+        stats["workers"] = self.workers
+        return stats
+
+    def _count(self, name, amount=1):
+        with self._counters_lock:
+            self._counters[name] += amount
+
+    def put(self, topic, payload, received_at, handler=None):
+        """Queue a message. Returns False if it was dropped.
+
+        With `handler`, the message is part of one already admitted, handed
+        over by a worker: it runs `handler` instead of the queue's own and is
+        never blocked or dropped, so workers cannot wait on each other.
+        """
+        message = (handler or self.handler, topic, payload, received_at)
+        priority = self.priority(topic) if (self.priority and self.overflow_policy == OVERFLOW_DROP_PRIORITY) else 0
+        shard = self._shards[zlib.crc32(topic.encode()) % self.workers]
+
+        with shard.cond:
+            if shard.size >= shard.max_size and handler is None:
+                if self.overflow_policy == OVERFLOW_BLOCK:
+                    self._count("blocked")
+                    while shard.size >= shard.max_size and self._running:
+                        shard.cond.wait(0.1)
+                elif self.overflow_policy == OVERFLOW_DROP_OLDEST:
+                    shard.drop_lowest()
+                    self._count("dropped")
+                elif shard.drop_lowest(below=priority):
+                    self._count("dropped")
+                else:
+                    self._count("dropped")
+                    return False
+            shard.push(priority, message)
+            shard.cond.notify()
+
+        depth = self.depth()
+        with self._counters_lock:
+            self._counters["enqueued"] += 1
+            if depth > self._counters["max_depth"]:
+                self._counters["max_depth"] = depth
+        return True
+
+    def _run(self, shard):
+        while True:
+            with shard.cond:
+                while not shard.size and self._running:
+                    shard.cond.wait(0.5)
+                if not shard.size:
+                    return
+                message = shard.pop_highest()
+                shard.cond.notify_all()
+            handler, topic, payload, received_at = message
+            try:
+                handler(topic, payload, received_at)
+            except Exception as e:
+                self._count("handler_errors")
+                print(f"⚠️ Erro ao processar mensagem de {topic}: {e}")
+            self._count("processed")
@@ -0,0 +1,199 @@
+import itertools
+import math
+import threading
+import time
+
+DEVICE_UNKNOWN = "unknown"
+DEVICE_ONLINE = "online"
+DEVICE_STALE = "stale"
+DEVICE_OFFLINE = "offline"
+DEVICE_STATUSES = (DEVICE_UNKNOWN, DEVICE_ONLINE, DEVICE_STALE, DEVICE_OFFLINE)
+
+
+def liveness_order(last_seen, status):
+    """Sort key of a transition: a later last-seen time wins, then the later status for the same time.
+
+    Lets a receiver drop a notification overtaken by a newer one, whichever
+    process or thread sent it.
+    """
+    return (last_seen or 0, DEVICE_STATUSES.index(status))
+
+
+class TimerWheel:
+    """Hashed timer wheel: scheduling is O(1) and each tick only visits one slot.
+
+    A timer due at tick t goes to slot t % slots; timers more than one turn
+    of the wheel away stay in their slot until the turn they are due.
+    """
+
+    def __init__(self, tick, slots, now):
+        self.tick = tick
+        self._slots = [[] for _ in range(slots)]
+        self._current = int(now // tick)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def schedule(self, deadline, item):
+        index = max(math.ceil(deadline / self.tick), self._current + 1)
+        self._slots[index % len(self._slots)].append((index, item))
+        self._count += 1
+
+    def advance(self, now):
+        """Return the items of every tick elapsed up to `now`, in deadline order."""
+        due = []
+        target = int(now // self.tick)
+        while self._current < target:
+            self._current += 1
+            position = self._current % len(self._slots)
+            slot = self._slots[position]
+            if not slot:
+                continue
+            remaining = [entry for entry in slot if entry[0] > self._current]
+            if len(remaining) != len(slot):
+                due.extend(item for index, item in slot if index <= self._current)
+                self._slots[position] = remaining
+                self._count -= len(slot) - len(remaining)
+        return due
+
+
+class LivenessTracker:
+    """Tracks when each device was last heard from and flags the silent ones.
+
+    A device is expected at least every `interval` seconds. It turns stale
+    after `interval * stale_after` seconds without a message and offline
+    after `interval * offline_after`; a device never heard from since it was
+    configured goes from unknown to offline, unless `expire_unseen` is False
+    (another process may be receiving its messages). `seen()` only stores the time:
+    each device has at most one timer, which on expiry checks the last-seen
+    time and re-arms itself if the device spoke in the meantime. So there is
+    no scan over all devices, and a message costs O(1) whatever the fleet size.
+    `on_change(key, status, last_seen)` runs on every status transition,
+    outside the lock, so notifications can arrive out of order: order them
+    with liveness_order().
+    """
+
+    def __init__(self, tick=1.0, slots=512, stale_after=1.5, offline_after=5.0, expire_unseen=True,
+                 on_change=None, clock=time.time):
+        self.tick = tick
+        self.stale_after = stale_after
+        self.offline_after = offline_after
+        self.expire_unseen = expire_unseen
+        self.on_change = on_change
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._wheel = TimerWheel(tick, slots, clock())
+        self._devices = {}
+        self._tokens = itertools.count(1)
+        self._counts = dict.fromkeys(DEVICE_STATUSES, 0)
+        self._transitions = 0
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="liveness", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def configure(self, key, interval):
+        """Track `key`, expected every `interval` seconds. Keeps the state of a known device."""
+        with self._lock:
+            device = self._devices.get(key)
+            if device is not None:
+                device["interval"] = interval
+                return
+            now = self.clock()
+            device = self._devices[key] = {"interval": interval, "last_seen": None, "status": DEVICE_UNKNOWN, "timer": None}
+            self._counts[DEVICE_UNKNOWN] += 1
+            if self.expire_unseen:
+                self._arm(key, device, now + interval * self.offline_after)
+
+    def retain(self, keys):
+        """Stop tracking every device not in `keys`; their timers lapse unseen."""
+        keys = set(keys)
+        with self._lock:
+            for key in [key for key in self._devices if key not in keys]:
+                self._counts[self._devices.pop(key)["status"]] -= 1
+
+    def seen(self, key):
+        """Record a message from `key`. O(1): no timer is touched while the device stays online."""
+        with self._lock:
+            device = self._devices.get(key)
+            if device is None:
+                return
+            now = device["last_seen"] = self.clock()
+            if device["status"] == DEVICE_ONLINE:
+                return
+            self._set_status(device, DEVICE_ONLINE)
+            self._arm(key, device, now + device["interval"] * self.stale_after)
+        if self.on_change:
+            self.on_change(key, DEVICE_ONLINE, now)
+
+    def status(self, key):
+        with self._lock:
+            device = self._devices.get(key)
+            return (device["status"], device["last_seen"]) if device is not None else (None, None)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts, timers=len(self._wheel), transitions=self._transitions)
+
+    def _arm(self, key, device, deadline):
+        # Caller holds self._lock; the token makes any older timer of the device a no-op
+        device["timer"] = next(self._tokens)
+        self._wheel.schedule(deadline, (key, device["timer"]))
+
+    def _set_status(self, device, status):
+        self._counts[device["status"]] -= 1
+        self._counts[status] += 1
+        device["status"] = status
+        self._transitions += 1
+
+    def _expire(self, key, token, now):
+        """Handle a due timer; return the new status, or None if nothing changed."""
+        device = self._devices.get(key)
+        if device is None or device["timer"] != token:
+            return None
+        device["timer"] = None
+        if device["status"] == DEVICE_UNKNOWN:
+            self._set_status(device, DEVICE_OFFLINE)
+            return DEVICE_OFFLINE
+        if device["status"] == DEVICE_ONLINE:
+            stale_at = device["last_seen"] + device["interval"] * self.stale_after
+            if now < stale_at:
+                self._arm(key, device, stale_at)
+                return None
+            self._set_status(device, DEVICE_STALE)
+            self._arm(key, device, device["last_seen"] + device["interval"] * self.offline_after)
+            return DEVICE_STALE
+        if device["status"] == DEVICE_STALE:
+            offline_at = device["last_seen"] + device["interval"] * self.offline_after
+            if now < offline_at:
+                self._arm(key, device, offline_at)
+                return None
+            self._set_status(device, DEVICE_OFFLINE)
+            return DEVICE_OFFLINE
+        return None
+
+    def _run(self):
+        while self._running:
+            time.sleep(self.tick)
+            changes = []
+            with self._lock:
+                now = self.clock()
+                for key, token in self._wheel.advance(now):
+                    status = self._expire(key, token, now)
+                    if status is not None:
+                        changes.append((key, status, self._devices[key]["last_seen"]))
+            if self.on_change:
+                for key, status, last_seen in changes:
+                    self.on_change(key, status, last_seen)
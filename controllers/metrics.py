@@ -0,0 +1,226 @@
+import bisect
+import threading
+import time
+
+# Minimal Prometheus text-format instrumentation. Recording a sample is a dict
+# lookup and a few additions under a per-metric lock; the text is only built
+# when /metrics is scraped.
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+HTTP_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, labels, extra=None):
+    pairs = list(zip(labelnames, labels))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self._values.get(labels, 0)
+
+    def total(self):
+        with self._lock:
+            return sum(self._values.values())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # labels -> [per-bucket counts (last one is +Inf), sum, count]
+        self._series = {}
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, labels=()):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, [list(counts), total, count]) for labels, (counts, total, count) in self._series.items())
+        for labels, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                label_text = _format_labels(self.labelnames, labels, ("le", _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, self.labels)
+
+
+class StatsCollector:
+    """Exposes a component's `stats()` dict at scrape time.
+
+    Keys listed in `counters` are rendered as `<prefix>_<key>_total` counters,
+    every other numeric key as a `<prefix>_<key>` gauge.
+    """
+
+    def __init__(self, prefix, stats, counters=(), help_text=""):
+        self.prefix = prefix
+        self.stats = stats
+        self.counters = set(counters)
+        self.help_text = help_text
+
+    def render(self):
+        lines = []
+        for key, value in sorted(self.stats().items()):
+            if not isinstance(value, (int, float)):
+                continue
+            if key in self.counters:
+                name, metric_type = f"{self.prefix}_{key}_total", "counter"
+            else:
+                name, metric_type = f"{self.prefix}_{key}", "gauge"
+            lines.append(f"# HELP {name} {self.help_text} ({key})")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(f"{name} {_format_value(value)}")
+        return lines
+
+
+class GroupedStatsCollector:
+    """Like StatsCollector, for a {label value: stats dict} mapping (e.g. one entry per process)."""
+
+    def __init__(self, prefix, groups, label, counters=(), help_text=""):
+        self.prefix = prefix
+        self.groups = groups
+        self.label = label
+        self.counters = set(counters)
+        self.help_text = help_text
+
+    def render(self):
+        series = {}
+        for group, stats in sorted(self.groups().items()):
+            for key, value in stats.items():
+                if isinstance(value, (int, float)):
+                    series.setdefault(key, []).append((group, int(value) if isinstance(value, bool) else value))
+        lines = []
+        for key, values in sorted(series.items()):
+            if key in self.counters:
+                name, metric_type = f"{self.prefix}_{key}_total", "counter"
+            else:
+                name, metric_type = f"{self.prefix}_{key}", "gauge"
+            lines.append(f"# HELP {name} {self.help_text} ({key})")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for group, value in values:
+                lines.append(f"{name}{_format_labels((self.label,), (group,))} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedRLock:
+    """Re-entrant lock that records how long callers wait for it and hold it.
+
+    Only the outermost acquire/release of a thread is measured, so nested
+    `with data_lock:` blocks are not counted twice.
+    """
+
+    def __init__(self, wait_histogram, hold_histogram):
+        self._lock = threading.RLock()
+        self._wait = wait_histogram
+        self._hold = hold_histogram
+        self._depth = 0
+        self._acquired_at = 0.0
+
+    def acquire(self, blocking=True, timeout=-1):
+        started = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            # Only the owning thread touches these while it holds the lock
+            self._depth += 1
+            if self._depth == 1:
+                self._acquired_at = time.perf_counter()
+                self._wait.observe(self._acquired_at - started)
+        return acquired
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self._hold.observe(time.perf_counter() - self._acquired_at)
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
@@ -0,0 +1,62 @@
+import datetime
+import json
+import math
+
+BATCH_MAX_READINGS = 256
+
+
+def parse_sensor_value(value):
+    """Convert a reading to float. Raises ValueError unless it is a finite number.
+
+    float() accepts "nan", "inf" and "1e999", which would poison the running
+    statistics and cannot be stored.
+    """
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(f"valor não finito: {value}")
+    return value
+
+
+def parse_batch_payload(payload, received_at):
+    """Decode a batched device publish into [(topic, value, timestamp), ...].
+
+    The payload is JSON: {"now": <device clock>, "r": [[topic, value, ts], ...]}.
+    `ts` is read on the same clock as `now`, so readings are placed relative
+    to `received_at` and a device without NTP (or with the MicroPython 2000
+    epoch) still gets correct timestamps. Without `now`, `ts` is taken as Unix
+    seconds; a reading without `ts` gets `received_at`. Readings come back in
+    timestamp order, so the last one per topic is the newest. Raises
+    ValueError on malformed payloads.
+    """
+    try:
+        data = json.loads(payload)
+    except ValueError as e:
+        raise ValueError(f"JSON inválido: {e}")
+    if not isinstance(data, dict) or not isinstance(data.get("r"), list):
+        raise ValueError("lote sem lista de leituras 'r'")
+    if len(data["r"]) > BATCH_MAX_READINGS:
+        raise ValueError(f"lote com mais de {BATCH_MAX_READINGS} leituras")
+
+    device_now = data.get("now")
+    readings = []
+    for item in data["r"]:
+        if not isinstance(item, list) or len(item) not in (2, 3):
+            raise ValueError(f"leitura inválida: {item!r}")
+        topic, value = item[0], item[1]
+        if not isinstance(topic, str) or not topic:
+            raise ValueError(f"tópico inválido: {topic!r}")
+        ts = item[2] if len(item) == 3 else None
+        try:
+            value = parse_sensor_value(value)
+            if ts is None:
+                timestamp = received_at
+            elif device_now is not None:
+                timestamp = received_at - datetime.timedelta(seconds=float(device_now) - float(ts))
+            else:
+                timestamp = datetime.datetime.fromtimestamp(float(ts))
+        except (TypeError, ValueError, OverflowError, OSError):
+            raise ValueError(f"leitura inválida: {item!r}")
+        # A reading from the future is a clock glitch, not a prediction
+        readings.append((topic, value, min(timestamp, received_at)))
+    readings.sort(key=lambda reading: reading[2])
+    return readings
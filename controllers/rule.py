@@ -0,0 +1,74 @@
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from controllers.shared import registry_changed
+from functools import wraps
+from models.iot.rule_model import AutomationRule, RULE_OPERATORS
+from models.iot.sensor_model import Sensor
+from models.iot.actuator_model import Actuator
+
+rule_main = Blueprint('rule_main', __name__, template_folder="templates")
+
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if session.get("role") != "admin":
+            flash("Acesso não autorizado", "error")
+            return redirect(url_for("user.login_page"))
+        return f(*args, **kwargs)
+    return decorated_function
+
+@rule_main.route("/manage", methods=["GET", "POST"])
+@admin_required
+def manage_rules_page():
+    if request.method == "POST":
+        name = request.form.get("name", "").strip()
+        operator = request.form.get("operator", ">")
+        try:
+            sensor_id = int(request.form.get("sensor_id", ""))
+            actuator_id = int(request.form.get("actuator_id", ""))
+            threshold = float(request.form.get("threshold", ""))
+            release = float(request.form.get("release", ""))
+        except ValueError:
+            flash("Sensor, atuador e valores numéricos são obrigatórios", "error")
+            return redirect(url_for("rule_main.manage_rules_page"))
+
+        error = AutomationRule.validate(operator, threshold, release)
+        if not name:
+            error = "O nome da regra é obrigatório"
+        elif Sensor.get_single_sensor(sensor_id) is None or Actuator.get_single_actuator(actuator_id) is None:
+            error = "Sensor ou atuador não encontrado"
+        if error:
+            flash(error, "error")
+            return redirect(url_for("rule_main.manage_rules_page"))
+
+        AutomationRule.save_rule(name, sensor_id, actuator_id, operator, threshold, release)
+        registry_changed()
+        flash(f"Regra '{name}' registrada com sucesso!", "success")
+        return redirect(url_for("rule_main.manage_rules_page"))
+
+    return render_template("manage_rule.html",
+                           rules=AutomationRule.get_rules(),
+                           sensors={sensor.id: sensor for sensor in Sensor.get_sensors()},
+                           actuators={actuator.id: actuator for actuator in Actuator.get_actuators()},
+                           operators=RULE_OPERATORS)
+
+@rule_main.route("/toggle/<int:rule_id>", methods=["POST"])
+@admin_required
+def toggle_rule(rule_id):
+    rule = AutomationRule.toggle_rule(rule_id)
+    if not rule:
+        flash("Regra não encontrada", "error")
+        return redirect(url_for("rule_main.manage_rules_page"))
+    registry_changed()
+    flash(f"Regra '{rule.name}' {'ativada' if rule.enabled else 'desativada'}", "success")
+    return redirect(url_for("rule_main.manage_rules_page"))
+
+@rule_main.route("/delete/<int:rule_id>", methods=["POST"])
+@admin_required
+def delete_rule(rule_id):
+    rule = AutomationRule.delete_rule(rule_id)
+    if not rule:
+        flash("Regra não encontrada", "error")
+        return redirect(url_for("rule_main.manage_rules_page"))
+    registry_changed()
+    flash(f"Regra '{rule.name}' removida com sucesso", "success")
+    return redirect(url_for("rule_main.manage_rules_page"))
@@ -0,0 +1,53 @@
+class RuleEngine:
+    """Evaluates threshold/hysteresis rules against incoming readings.
+
+    Rules are compiled into a {sensor id: [rule, ...]} index that is
+    replaced whole on reload, so a reading only looks at the rules bound to
+    its sensor and readers never see a half-built index. Readings are looked
+    up by the sensor the topic router matched them to, so rules on sensors
+    with wildcard topics fire too. Each rule remembers the last output it
+    issued and only emits a command when that output changes; until it has
+    issued one, only crossing the threshold does, so a reading below the
+    release point does not switch off an actuator nobody switched on.
+    Readings of one topic are handled by a single ingest worker, so a rule's
+    state is never updated concurrently.
+    """
+
+    def __init__(self):
+        self._index = {}
+        self._outputs = {}
+
+    def load(self, rules):
+        """Replace the rule set. `rules` are dicts with id, sensor_id, operator, threshold, release and actuator."""
+        index = {}
+        for rule in rules:
+            index.setdefault(rule["sensor_id"], []).append(rule)
+        # Keep the hysteresis state of rules that survive the reload
+        self._outputs = {rule["id"]: self._outputs[rule["id"]] for rule in rules if rule["id"] in self._outputs}
+        self._index = index
+
+    def __len__(self):
+        return sum(len(rules) for rules in self._index.values())
+
+    def rules_for(self, sensor_id):
+        return self._index.get(sensor_id, ())
+
+    def evaluate(self, sensor_id, value):
+        """Return [(rule, "ON" | "OFF"), ...] for the rules whose output changed."""
+        actions = []
+        for rule in self._index.get(sensor_id, ()):
+            if rule["operator"] == ">":
+                turn_on, turn_off = value > rule["threshold"], value < rule["release"]
+            else:
+                turn_on, turn_off = value < rule["threshold"], value > rule["release"]
+            current = self._outputs.get(rule["id"])
+            if turn_on:
+                output = True
+            elif turn_off and current is not None:
+                output = False
+            else:
+                continue  # inside the hysteresis band, or nothing to release yet
+            if current != output:
+                self._outputs[rule["id"]] = output
+                actions.append((rule, "ON" if output else "OFF"))
+        return actions
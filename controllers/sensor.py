@@ -1,5 +1,5 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session
-from controllers.shared import devices, data_lock, mqtt_client
+from controllers.shared import topic_router, register_sensor_route, registry_changed
 import uuid
 import time
 import paho.mqtt.client as mqtt
@@ -36,11 +36,10 @@ def register_sensor_page():
                 flash("Já existe um sensor com este tópico MQTT", "error")
                 return redirect(url_for("sensor_main.register_sensor_page"))
         
-        Sensor.save_sensor(name = sensor_name, topic = sensor_topic, unit = sensor_type)
-        
-        # Subscribe to MQTT topic
-        mqtt_client.subscribe(sensor_topic)
-        print(f"🔔 Subscribed to new sensor topic: {sensor_topic}")
+        sensor = Sensor.save_sensor(name = sensor_name, topic = sensor_topic, unit = sensor_type)
+        register_sensor_route(sensor)
+        # Subscribes to the new topic in the ingest process
+        registry_changed()
         
         flash(f"Sensor '{sensor_name}' registrado com sucesso!", "success")
         return redirect(url_for("sensor_main.manage_sensors_page"))
@@ -56,23 +55,19 @@ def manage_sensors_page():
 @admin_required
 @sensor_main.route("/delete/<int:sensor_id>", methods=["POST"])
 def delete_sensor(sensor_id):
-    from app import app
-    with app.app_context():
-        sensor = Sensor.query.get(sensor_id)
-
-        if not sensor:
-            print(f"⚠️ Sensor com ID {sensor_id} não encontrado.")
-            return redirect(url_for("sensor_main.manage_sensors_page"))
+    sensor = Sensor.query.get(sensor_id)
 
-        if sensor.topic:
-            mqtt_client.unsubscribe(sensor.topic)
-            print(f"🔕 Unsubscrito do tópico: {sensor.topic}")
+    if not sensor:
+        print(f"⚠️ Sensor com ID {sensor_id} não encontrado.")
+        return redirect(url_for("sensor_main.manage_sensors_page"))
 
-        Sensor.delete_sensor(sensor_id)
+    Sensor.delete_sensor(sensor_id)
+    topic_router.remove_route("sensor", sensor_id)
+    registry_changed()
 
-        flash(f"Atuador '{sensor.name}' removido com sucesso", "success")
-        print(f"🗑️ Deleted actuator: {sensor.name}")
-        return redirect(url_for("sensor_main.manage_sensors_page"))
+    flash(f"Atuador '{sensor.name}' removido com sucesso", "success")
+    print(f"🗑️ Deleted actuator: {sensor.name}")
+    return redirect(url_for("sensor_main.manage_sensors_page"))
 
 @admin_required
 @sensor_main.route("/edit/<int:sensor_id>", methods=["GET", "POST"])
@@ -89,8 +84,22 @@ def edit_sensor(sensor_id):
         if not sensor_name:
             flash("Nome do sensor é obrigatório!", "error")
             return render_template("edit_sensor.html", sensor=sensor)
+
+        try:
+            deadband_abs = float(request.form.get("deadband_abs") or 0)
+            deadband_pct = float(request.form.get("deadband_pct") or 0)
+            max_silence = int(request.form.get("max_silence") or 0)
+        except ValueError:
+            flash("Os valores de banda morta devem ser numéricos!", "error")
+            return render_template("edit_sensor.html", sensor=sensor)
+        if min(deadband_abs, deadband_pct, max_silence) < 0:
+            flash("Os valores de banda morta não podem ser negativos!", "error")
+            return render_template("edit_sensor.html", sensor=sensor)
         
-        Sensor.update_sensor(sensor_id, sensor_name, unit = data_type)
+        Sensor.update_sensor(sensor_id, sensor_name, unit = data_type, deadband_abs = deadband_abs,
+                             deadband_pct = deadband_pct, max_silence = max_silence)
+        register_sensor_route(sensor)
+        registry_changed()
         
         flash("Sensor atualizado com sucesso!", "success")
         return redirect(url_for("sensor_main.manage_sensors_page"))
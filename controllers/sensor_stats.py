@@ -0,0 +1,69 @@
+import math
+
+# Readings closer together than this are not used for the rate: with
+# sub-second or repeated timestamps the difference quotient explodes
+RATE_MIN_SECONDS = 1.0
+
+
+class RunningStats:
+    """Statistics of one sensor's readings, updated per reading in constant memory.
+
+    Welford's algorithm keeps the mean and variance of every reading seen
+    without storing them, the EWMA follows the recent level, and the rate of
+    change is per second, measured over at least RATE_MIN_SECONDS and smoothed
+    with the same EWMA factor. Count, mean, M2 and EWMA are enough to resume
+    after a restart; the rate starts over.
+    """
+
+    __slots__ = ("count", "mean", "m2", "ewma", "rate", "last_value", "last_timestamp")
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, ewma=None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.ewma = ewma
+        self.rate = None
+        self.last_value = None
+        self.last_timestamp = None
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def zscore(self, value):
+        """Standard deviations between `value` and the mean, or None while the spread is zero."""
+        std = self.std
+        return (value - self.mean) / std if std > 0 else None
+
+    def update(self, value, timestamp, alpha):
+        # NaN or infinity would stick in the mean and M2 for good
+        if not math.isfinite(value):
+            return
+        # last_value/last_timestamp is the rate's reference reading; it only
+        # moves on once RATE_MIN_SECONDS have passed
+        if self.last_timestamp is None:
+            self.last_value, self.last_timestamp = value, timestamp
+        else:
+            elapsed = (timestamp - self.last_timestamp).total_seconds()
+            if elapsed >= RATE_MIN_SECONDS:
+                rate = (value - self.last_value) / elapsed
+                self.rate = rate if self.rate is None else alpha * rate + (1 - alpha) * self.rate
+                self.last_value, self.last_timestamp = value, timestamp
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.ewma = value if self.ewma is None else alpha * value + (1 - alpha) * self.ewma
+
+    def columns(self):
+        """Values for the Sensor stats_* columns."""
+        return {"stats_count": self.count, "stats_mean": self.mean, "stats_m2": self.m2, "stats_ewma": self.ewma}
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean": round(self.mean, 4) if self.count else None,
+            "std": round(self.std, 4) if self.count > 1 else None,
+            "ewma": round(self.ewma, 4) if self.ewma is not None else None,
+            "rate_per_min": round(self.rate * 60, 4) if self.rate is not None else None,
+        }
@@ -0,0 +1,108 @@
+import math
+from models.db import db
+from models.iot.sensor_reading_model import SensorReading, SensorRollup, ROLLUP_MINUTE, ROLLUP_HOUR
+
+SERIES_POINTS_DEFAULT = 1000
+SERIES_POINTS_MAX = 5000
+
+
+def lttb(xs, ys, threshold):
+    """Largest-Triangle-Three-Buckets: indices of `threshold` points that keep the shape of the line.
+
+    The first and last points are always kept; every bucket in between keeps
+    the point forming the largest triangle with the previously kept point and
+    the average of the next bucket.
+    """
+    count = len(xs)
+    if threshold >= count:
+        return list(range(count))
+    if threshold < 3:
+        return [0, count - 1][:threshold]
+
+    every = (count - 2) / (threshold - 2)
+    selected = [0]
+    previous = 0
+    for bucket in range(threshold - 2):
+        next_start = int((bucket + 1) * every) + 1
+        next_end = min(int((bucket + 2) * every) + 1, count)
+        next_x = math.fsum(xs[next_start:next_end]) / (next_end - next_start)
+        next_y = math.fsum(ys[next_start:next_end]) / (next_end - next_start)
+
+        ax, ay = xs[previous], ys[previous]
+        best, best_area = -1, -1.0
+        for index in range(int(bucket * every) + 1, next_start):
+            area = abs((ax - next_x) * (ys[index] - ay) - (ax - xs[index]) * (next_y - ay))
+            if area > best_area:
+                best, best_area = index, area
+        selected.append(best)
+        previous = best
+    selected.append(count - 1)
+    return selected
+
+
+def rollup_buckets(rollups, start, width):
+    """Merge rollup rows into buckets of `width` seconds aligned on `start`."""
+    buckets = {}
+    for rollup in rollups:
+        index = int((rollup.bucket_start - start).total_seconds() // width)
+        bucket = buckets.get(index)
+        if bucket is None:
+            buckets[index] = [rollup.bucket_start, rollup.min_value, rollup.max_value, rollup.sum_value, rollup.count]
+        else:
+            bucket[1] = min(bucket[1], rollup.min_value)
+            bucket[2] = max(bucket[2], rollup.max_value)
+            bucket[3] += rollup.sum_value
+            bucket[4] += rollup.count
+    return [
+        {
+            "t": timestamp.isoformat(timespec="seconds"),
+            "value": sum_value / count,
+            "min": min_value,
+            "max": max_value,
+            "count": count,
+        }
+        for index, (timestamp, min_value, max_value, sum_value, count) in sorted(buckets.items())
+    ]
+
+
+def raw_series(sensor_id, start, end, points):
+    rows = (
+        db.session.query(SensorReading.timestamp, SensorReading.value)
+        .filter(SensorReading.sensor_id == sensor_id,
+                SensorReading.timestamp >= start,
+                SensorReading.timestamp < end)
+        .order_by(SensorReading.timestamp)
+        .all()
+    )
+    xs = [timestamp.timestamp() for timestamp, value in rows]
+    ys = [value for timestamp, value in rows]
+    return [
+        {"t": rows[index][0].isoformat(timespec="seconds"), "value": ys[index]}
+        for index in lttb(xs, ys, points)
+    ]
+
+
+def sensor_series(sensor_id, start, end, points):
+    """Return (source, samples) with at most about `points` samples for [start, end).
+
+    Uses the coarsest rollup whose resolution still fits the requested point
+    count. Readings stored before rollups existed have none, so the part of
+    the range before the first rollup (or all of it) is read from the raw
+    readings and reduced with LTTB.
+    """
+    width = max((end - start).total_seconds() / points, 1)
+    for resolution, source in ((ROLLUP_HOUR, "rollup_hour"), (ROLLUP_MINUTE, "rollup_minute")):
+        if width < resolution:
+            continue
+        rollups = SensorRollup.get_rollups(sensor_id, resolution, start, end)
+        if not rollups:
+            continue
+        # Whole rollup buckets per sample, so a sample never splits one
+        bucket_width = math.ceil(width / resolution) * resolution
+        samples = rollup_buckets(rollups, start, bucket_width)
+        covered_from = rollups[0].bucket_start
+        if covered_from > start and points > len(samples):
+            samples = raw_series(sensor_id, start, covered_from, points - len(samples)) + samples
+        return source, samples
+
+    return "raw", raw_series(sensor_id, start, end, points)
@@ -1,11 +1,29 @@
+import os
+import socket
 import threading
 import time
+from collections import deque
 import uuid
 import datetime
 import paho.mqtt.client as mqtt
 from models.db import db
 from models.iot.sensor_model import Sensor
 from models.iot.actuator_model import Actuator
+from models.iot.sensor_reading_model import SensorReading, SensorRollup
+from models.iot.command_model import CommandLog, TIMESTAMP_FORMAT
+from models.iot.rule_model import AutomationRule
+from controllers.topic_router import TopicRouter
+from controllers.write_behind import WriteBehindBuffer
+from controllers.broadcaster import Broadcaster
+from controllers.state_store import LocalStateStore, create_state_store
+from controllers.ingest_queue import IngestQueue
+from controllers.rule_engine import RuleEngine
+from controllers.command_tracker import CommandTracker, parse_status_payload, COMMAND_ACKED
+from controllers.payloads import parse_batch_payload, parse_sensor_value
+from controllers.liveness import LivenessTracker, liveness_order
+from controllers.sensor_stats import RunningStats
+from controllers.subscriptions import plan_subscriptions, batched
+from controllers.metrics import Registry, StatsCollector, GroupedStatsCollector, InstrumentedRLock, HTTP_BUCKETS
 from flask import current_app
 
 flask_app = None
@@ -13,13 +31,82 @@ flask_app = None
 def set_flask_app(app):
     global flask_app
     flask_app = app
+    write_buffer.set_app(app)
     print("✅ Flask app configurada no módulo MQTT")
 
 
+# --- Deployment Role ---
+# "all": a single process serves HTTP and owns the MQTT ingest (default).
+# "ingest": dedicated process owning the MQTT subscriptions (see ingest.py).
+# "web": HTTP worker; publishes commands but never subscribes, and reads
+# device state replicated through the shared store (IOT_STATE_STORE_URL).
+IOT_ROLE = os.environ.get("IOT_ROLE", "all")
+IOT_STATE_STORE_URL = os.environ.get("IOT_STATE_STORE_URL")
+INGEST_ENABLED = IOT_ROLE in ("all", "ingest")
+
 # --- MQTT Configuration ---
-MQTT_BROKER_HOST = "broker.emqx.io"
-MQTT_BROKER_PORT = 1883
+MQTT_BROKER_HOST = os.environ.get("IOT_MQTT_HOST", "broker.emqx.io")
+MQTT_BROKER_PORT = int(os.environ.get("IOT_MQTT_PORT", 1883))
 MQTT_CLIENT_ID = f"flask_iot_{uuid.uuid4().hex[:8]}"
+# Subscription QoS per route kind: status reports drive command
+# acknowledgements, so they are not dropped on the way in.
+MQTT_SUBSCRIPTION_QOS = {"sensor": 0, "actuator": 1, "batch": 1}
+# Fold topics into a covering "+" filter once this many registered topics
+# share it (0 disables). Off by default: on a public broker a wildcard also
+# pulls in other users' traffic.
+MQTT_WILDCARD_MIN_TOPICS = int(os.environ.get("IOT_MQTT_WILDCARD_MIN_TOPICS", 0))
+
+# --- Sharded Ingest ---
+# With a shared group, ingest subscribes through "$share/<group>/<filter>" and
+# the broker spreads the messages over every consumer of the group, each with
+# its own queue, routing table and write buffer (see ingest.py --consumers).
+MQTT_SHARED_GROUP = os.environ.get("IOT_MQTT_SHARED_GROUP")
+INGEST_CONSUMER_NAME = os.environ.get("IOT_INGEST_CONSUMER") or f"{socket.gethostname()}-{os.getpid()}"
+# Each ingest process reports its status to the state store this often
+INGEST_STATUS_INTERVAL = 5
+
+# --- Write-behind Persistence ---
+WRITE_BEHIND_FLUSH_INTERVAL_MS = 250
+WRITE_BEHIND_MAX_DIRTY = 500
+WRITE_BEHIND_MAX_PENDING = 10000
+
+# --- Ingest Queue ---
+# The paho callback only enqueues; these workers route and persist messages.
+# Overflow policy: "block", "drop_oldest" or "drop_priority" (actuator status
+# messages outrank sensor readings).
+INGEST_WORKERS = int(os.environ.get("IOT_INGEST_WORKERS", 2))
+INGEST_QUEUE_MAX_SIZE = 10000
+INGEST_OVERFLOW_POLICY = os.environ.get("IOT_INGEST_OVERFLOW_POLICY", "drop_oldest")
+
+# --- Command Acknowledgement ---
+# Commands stay pending until the actuator reports the requested state on its
+# status topic; unconfirmed ones are resent after ACK_TIMEOUT * BACKOFF**attempt.
+COMMAND_ACK_TIMEOUT = 5.0
+COMMAND_MAX_RETRIES = 3
+COMMAND_RETRY_BACKOFF = 2.0
+
+# --- Device Liveness ---
+# A sensor is expected at least every `max_silence` seconds (its heartbeat),
+# or LIVENESS_DEFAULT_INTERVAL when it has none; it is flagged stale after
+# STALE_AFTER intervals without a message and offline after OFFLINE_AFTER.
+LIVENESS_DEFAULT_INTERVAL = int(os.environ.get("IOT_LIVENESS_INTERVAL", 60))
+LIVENESS_STALE_AFTER = 1.5
+LIVENESS_OFFLINE_AFTER = 5.0
+LIVENESS_TICK_SECONDS = 1.0
+LIVENESS_WHEEL_SLOTS = 512
+
+# --- Sensor Statistics ---
+# Every reading updates its sensor's running statistics (Welford mean and
+# variance, EWMA, rate of change) in constant memory. Once a sensor has
+# ANOMALY_MIN_SAMPLES readings, one more than ANOMALY_SIGMAS standard
+# deviations from its mean is flagged as an anomaly.
+STATS_EWMA_ALPHA = 0.1
+ANOMALY_SIGMAS = float(os.environ.get("IOT_ANOMALY_SIGMAS", 3))
+ANOMALY_MIN_SAMPLES = 30
+
+# --- Automation ---
+# Commands issued by automation rules are logged under this user name.
+RULE_COMMAND_USER = "automação"
 
 # --- Default Topics ---
 TOPIC_TEMPERATURE_DEFAULT = "iot/sensor/temperatura"
@@ -30,10 +117,119 @@ TOPIC_WATER_VALVE_CMD_DEFAULT = "iot/actuator/Mangueira_de_agua/command"
 TOPIC_WATER_VALVE_STATUS_DEFAULT = "iot/actuator/Mangueira_de_agua/status"
 TOPIC_HEATER_CMD_DEFAULT = "iot/actuator/Aquecedor/command"
 TOPIC_HEATER_STATUS_DEFAULT = "iot/actuator/Aquecedor/status"
+# Devices publish batched readings to iot/batch/<client id>
+TOPIC_BATCH_FILTER = "iot/batch/+"
+
+# --- Metrics ---
+# Exposed in Prometheus text format on /metrics.
+metrics = Registry()
+mqtt_messages = metrics.counter("iot_mqtt_messages_total", "MQTT messages processed, by topic class", ("topic_class",))
+mqtt_on_message_seconds = metrics.histogram("iot_mqtt_on_message_seconds", "Time spent in the paho on_message callback")
+ingest_process_seconds = metrics.histogram("iot_ingest_process_seconds", "Time to route and apply one message", ("topic_class",))
+ingest_latency_seconds = metrics.histogram("iot_ingest_latency_seconds", "Time from MQTT receipt to state update, queueing included")
+sensor_anomalies = metrics.counter("iot_sensor_anomalies_total", "Sensor readings flagged as anomalies", ("sensor",))
+suppressed_readings = metrics.counter("iot_suppressed_readings_total", "Sensor readings not stored because of the sensor deadband", ("sensor",))
+batch_readings = metrics.histogram("iot_batch_readings", "Readings carried per batched device message", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+db_commit_seconds = metrics.histogram("iot_db_commit_seconds", "Duration of write-behind flush transactions", ("result",))
+data_lock_wait_seconds = metrics.histogram("iot_data_lock_wait_seconds", "Time spent waiting to acquire data_lock")
+data_lock_hold_seconds = metrics.histogram("iot_data_lock_hold_seconds", "Time data_lock is held per acquisition")
+mqtt_connects = metrics.counter("iot_mqtt_connects_total", "MQTT CONNACKs received, by result", ("result",))
+mqtt_disconnects = metrics.counter("iot_mqtt_disconnects_total", "MQTT disconnections")
+mqtt_reconnects = metrics.counter("iot_mqtt_reconnects_total", "Reconnection attempts made by mqtt_thread_worker")
+command_ack_seconds = metrics.histogram("iot_command_ack_seconds", "Time from sending a command to its acknowledgement", ("actuator",), HTTP_BUCKETS)
+rule_commands = metrics.counter("iot_rule_commands_total", "Actuator commands issued by automation rules", ("rule",))
+command_results = metrics.counter("iot_command_results_total", "Tracked commands by outcome", ("result",))
+http_request_seconds = metrics.histogram("iot_http_request_seconds", "HTTP request latency, by endpoint", ("endpoint", "method"), HTTP_BUCKETS)
+http_requests = metrics.counter("iot_http_requests_total", "HTTP requests, by endpoint and status", ("endpoint", "method", "status"))
 
 # --- Shared Resources ---
-data_lock = threading.Lock()
-command_history = []
+# Commands are persisted in the command_history table; this ring buffer only
+# keeps the most recent ones hot for the dashboards.
+COMMAND_HISTORY_CACHE_SIZE = 50
+data_lock = InstrumentedRLock(data_lock_wait_seconds, data_lock_hold_seconds)
+command_history = deque(maxlen=COMMAND_HISTORY_CACHE_SIZE)
+
+# --- Shared State ---
+# Every mutation of `devices`/`command_history` is published through the
+# state store, which assigns it a version and delivers it to every process
+# (apply_change). The epoch changes when the store is reset, so clients
+# holding a version from before fall back to a full snapshot. The store is
+# created on first use (start_services), so importing this module does no
+# network I/O; always reach it through get_state_store().
+state_store = None
+state_store_lock = threading.Lock()
+state_version = 0
+device_versions = {"sensors": {}, "actuators": {}}
+topic_router = TopicRouter()
+# Filters currently subscribed on the broker {topic_filter: qos}
+subscribed_filters = {}
+subscription_lock = threading.Lock()
+rule_engine = RuleEngine()
+# Per-sensor deadband settings {id: (abs, pct, max_silence)} and the last
+# stored reading {id: (value, timestamp)} that new readings are compared to
+sensor_deadbands = {}
+last_stored_readings = {}
+# Sensor id -> RunningStats. Like the deadband state it is not locked: the
+# ingest queue shards by topic, so one worker handles each sensor. With
+# several consumers in a shared group this state is per process, so the
+# broker must deliver each topic to a single consumer (see README)
+sensor_statistics = {}
+broadcaster = Broadcaster()
+ingest_queue = IngestQueue(
+    lambda topic, payload, received_at: process_message(topic, payload, received_at),
+    workers=INGEST_WORKERS,
+    max_size=INGEST_QUEUE_MAX_SIZE,
+    overflow_policy=INGEST_OVERFLOW_POLICY,
+    priority=lambda topic: message_priority(topic),
+)
+command_tracker = CommandTracker(
+    lambda topic, payload: mqtt_client.publish(topic, payload),
+    ack_timeout=COMMAND_ACK_TIMEOUT,
+    max_retries=COMMAND_MAX_RETRIES,
+    backoff=COMMAND_RETRY_BACKOFF,
+    on_resolved=lambda command: command_resolved(command),
+    on_ack_latency=lambda actuator_id, seconds: command_ack_seconds.observe(seconds, (actuator_id,)),
+)
+write_buffer = WriteBehindBuffer(
+    flush_interval_ms=WRITE_BEHIND_FLUSH_INTERVAL_MS,
+    max_dirty=WRITE_BEHIND_MAX_DIRTY,
+    max_pending=WRITE_BEHIND_MAX_PENDING,
+)
+liveness = LivenessTracker(
+    tick=LIVENESS_TICK_SECONDS,
+    slots=LIVENESS_WHEEL_SLOTS,
+    stale_after=LIVENESS_STALE_AFTER,
+    offline_after=LIVENESS_OFFLINE_AFTER,
+    # In a shared group a sensor's messages may all go to another consumer
+    expire_unseen=not MQTT_SHARED_GROUP,
+    on_change=lambda sensor_id, status, last_seen: sensor_liveness_changed(sensor_id, status, last_seen),
+)
+# Sensor id -> {"sensor_id", "topic", "status", "last_seen", "version"}, as
+# delivered by the state store; guarded by data_lock
+sensor_liveness = {}
+
+metrics.register(StatsCollector("iot_write_buffer", write_buffer.stats, help_text="Write-behind buffer",
+                                 counters=("puts", "appends", "rows_inserted", "coalesced", "flushes",
+                                           "failed_flushes", "dropped_rows", "rows_flushed", "total_flush_ms")))
+metrics.register(StatsCollector("iot_ingest_queue", ingest_queue.stats, help_text="Ingest queue",
+                                 counters=("enqueued", "processed", "dropped", "blocked", "handler_errors")))
+metrics.register(StatsCollector("iot_sse", broadcaster.stats, help_text="Server-Sent Events broadcaster",
+                                 counters=("events", "dropped_clients")))
+metrics.register(StatsCollector("iot_sensor_liveness", liveness.stats, help_text="Sensors by liveness status",
+                                 counters=("transitions",)))
+metrics.register(GroupedStatsCollector("iot_consumer", lambda: get_state_store().load_statuses(), "consumer",
+                                        help_text="Ingest consumer, as last reported",
+                                        counters=("messages", "processed", "dropped", "rows_flushed", "failed_flushes")))
+write_buffer.add_flush_listener(
+    lambda seconds, rows, ok: db_commit_seconds.observe(seconds, ("ok",) if ok else ("error",))
+)
+
+def apply_sensor_rollups(appended):
+    readings = appended.get(SensorReading)
+    if readings:
+        SensorRollup.apply_readings(readings)
+
+write_buffer.add_flush_hook(apply_sensor_rollups)
 
 # --- Dispositivos (Sensores e Atuadores) ---
 devices = {
@@ -85,62 +281,661 @@ devices = {
     }
 }
 
+# Actuator id -> key in devices["actuators"], so commands resolve in O(1)
+actuator_keys_by_id = {actuator["id"]: key for key, actuator in devices["actuators"].items()}
+
+# --- Read Snapshot ---
+# Page renders and API reads use this view instead of `devices` and the
+# database. It is never mutated: writers build a new dict under
+# `snapshot_lock` and swap the reference (copy-on-write), so readers neither
+# lock nor query. "registry_sensors"/"registry_actuators" mirror the database
+# rows by id; in the web role they are refreshed every
+# DASHBOARD_REFRESH_SECONDS, since readings are ingested by another process.
+# The one exception to copy-on-write is update_registry_snapshot, which swaps
+# single registry entries (never adding or removing keys) so that a reading
+# does not copy the whole section.
+DASHBOARD_REFRESH_SECONDS = 5
+snapshot_lock = threading.Lock()
+read_snapshot = {
+    "version": 0,
+    "sensors": dict(devices["sensors"]),
+    "actuators": dict(devices["actuators"]),
+    "device_versions": {"sensors": {}, "actuators": {}},
+    "command_history": (),
+    "registry_sensors": {},
+    "registry_actuators": {},
+    "liveness": {},
+}
+
+def get_read_snapshot():
+    return read_snapshot
+
+def swap_snapshot(**changes):
+    global read_snapshot
+    with snapshot_lock:
+        read_snapshot = dict(read_snapshot, **changes)
+
+def publish_state_snapshot(history=False):
+    """Swap in the current `devices` view. Caller must hold `data_lock`."""
+    changes = {
+        "version": state_version,
+        "sensors": dict(devices["sensors"]),
+        "actuators": dict(devices["actuators"]),
+        "device_versions": {section: dict(versions) for section, versions in device_versions.items()},
+    }
+    if history:
+        changes["command_history"] = tuple(command_history)
+    swap_snapshot(**changes)
+
+def publish_liveness_snapshot():
+    """Swap in the current `sensor_liveness` view. Caller must hold `data_lock`."""
+    swap_snapshot(version=state_version, liveness=dict(sensor_liveness))
+
+def sensor_snapshot(sensor):
+    entry = sensor_liveness.get(sensor.id, {})
+    stats = sensor_statistics.get(sensor.id) or RunningStats(sensor.stats_count, sensor.stats_mean, sensor.stats_m2, sensor.stats_ewma)
+    return {
+        "id": sensor.id,
+        "name": sensor.name,
+        "topic": sensor.topic,
+        "unit": sensor.unit,
+        "value": sensor.value,
+        "timestamp": sensor.updated_at or sensor.created_at,
+        "status": entry.get("status", "unknown"),
+        "last_seen": entry.get("last_seen"),
+        "stats": stats.to_dict(),
+    }
+
+def actuator_snapshot(actuator):
+    return {
+        "id": actuator.id,
+        "name": actuator.name,
+        "topic_command": actuator.topic_command,
+        "topic_status": actuator.topic_status,
+        "is_active": actuator.is_active,
+        "unit": actuator.unit,
+    }
+
+def rebuild_registry_snapshot():
+    """Reload the database part of the snapshot (needs an app context)."""
+    sensors = {sensor.id: sensor_snapshot(sensor) for sensor in Sensor.get_sensors()}
+    actuators = {actuator.id: actuator_snapshot(actuator) for actuator in Actuator.get_actuators()}
+    swap_snapshot(registry_sensors=sensors, registry_actuators=actuators)
+    with data_lock:
+        removed = [sensor_id for sensor_id in sensor_liveness if sensor_id not in sensors]
+        if removed:
+            for sensor_id in removed:
+                del sensor_liveness[sensor_id]
+            publish_liveness_snapshot()
+
+def update_registry_snapshot(section, device_id, **values):
+    """Replace one entry of a registry section, in O(1) whatever the fleet size.
+
+    The section is not copied: the new entry is assigned to its existing key,
+    which never resizes the dict, so readers iterating it stay safe.
+    """
+    with snapshot_lock:
+        entries = read_snapshot[section]
+        entry = entries.get(device_id)
+        if entry is None:
+            return
+        entries[device_id] = dict(entry, **values)
+
+def snapshot_refresher():
+    while True:
+        time.sleep(DASHBOARD_REFRESH_SECONDS)
+        try:
+            with flask_app.app_context():
+                rebuild_registry_snapshot()
+        except Exception as e:
+            print(f"⚠️ Erro ao atualizar o snapshot do painel: {e}")
+
 # --- MQTT Client ---
 mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=MQTT_CLIENT_ID)
 
 def on_connect(client, userdata, flags, rc, properties=None):
+    mqtt_connects.inc(("success",) if rc == 0 else ("failure",))
     if rc == 0:
         print(f"✅ Conectado ao broker MQTT: {MQTT_BROKER_HOST}")
         if flask_app is None:
             print("⚠️ Aviso: Flask app não configurada!")
             return
             
-        with flask_app.app_context():
-            print("🔍 Buscando sensores no banco de dados...")
-            for sensor in Sensor.get_sensors():
-                if sensor.topic:
-                    client.subscribe(sensor.topic)
-                    print(f"🔔 Subscrito em {sensor.topic}")
-
-            print("🔍 Buscando atuadores no banco de dados...")
-            for actuator in Actuator.get_actuators():
-                if actuator.topic_status:
-                    client.subscribe(actuator.topic_status)
-                    print(f"🔔 Subscrito em {actuator.topic_status}")
+        if not INGEST_ENABLED:
+            print("📤 Modo web: conexão MQTT usada apenas para publicar comandos")
+            return
+
+        # A new session starts with no subscriptions; resend them from the routing table
+        with subscription_lock:
+            subscribed_filters.clear()
+        sync_subscriptions()
     else:
         print(f"❌ Falha na conexão com código {rc}")
 
+def register_sensor_route(sensor):
+    topic_router.add_route(sensor.topic, "sensor", sensor.id, sensor.name)
+    if INGEST_ENABLED:
+        liveness.configure(sensor.id, sensor.max_silence or LIVENESS_DEFAULT_INTERVAL)
+        if sensor.id not in sensor_statistics:
+            sensor_statistics[sensor.id] = RunningStats(sensor.stats_count, sensor.stats_mean, sensor.stats_m2, sensor.stats_ewma)
+    if sensor.deadband_abs or sensor.deadband_pct or sensor.max_silence:
+        sensor_deadbands[sensor.id] = (sensor.deadband_abs, sensor.deadband_pct, sensor.max_silence)
+    else:
+        sensor_deadbands.pop(sensor.id, None)
+
+def register_actuator_route(actuator):
+    topic_router.add_route(actuator.topic_status, "actuator", actuator.id, actuator.name)
+
+def load_routes():
+    """Rebuild the topic routing table from the database (needs an app context)."""
+    topic_router.clear()
+    sensors = Sensor.get_sensors()
+    for sensor in sensors:
+        register_sensor_route(sensor)
+    prune_sensor_state({sensor.id for sensor in sensors})
+    for actuator in Actuator.get_actuators():
+        register_actuator_route(actuator)
+    topic_router.add_route(TOPIC_BATCH_FILTER, "batch", None)
+    rebuild_registry_snapshot()
+    load_rules()
+    print(f"🧭 Tabela de roteamento carregada: {len(topic_router)} rotas")
+
+def prune_sensor_state(sensor_ids):
+    """Forget the ingest state (liveness timer, statistics, deadband) of sensors not in `sensor_ids`."""
+    if INGEST_ENABLED:
+        liveness.retain(sensor_ids)
+    for state in (sensor_statistics, sensor_deadbands, last_stored_readings):
+        for sensor_id in set(state) - sensor_ids:
+            state.pop(sensor_id, None)
+
+def load_rules():
+    """Compile the enabled automation rules into the per-sensor index (needs an app context)."""
+    sensors = {sensor.id: sensor for sensor in Sensor.get_sensors()}
+    actuators = {actuator.id: actuator for actuator in Actuator.get_actuators()}
+    with data_lock:
+        # Rules driving a dashboard actuator go through its entry, so the
+        # pending command shows up like a manual one
+        device_ids = {actuator["command_topic"]: actuator["id"] for actuator in devices["actuators"].values()}
+    rules = []
+    for rule in AutomationRule.get_enabled_rules():
+        sensor = sensors.get(rule.sensor_id)
+        actuator = actuators.get(rule.actuator_id)
+        if sensor is None or actuator is None or not sensor.topic:
+            continue
+        rules.append({
+            "id": rule.id,
+            "name": rule.name,
+            "sensor_id": sensor.id,
+            "operator": rule.operator,
+            "threshold": rule.threshold,
+            "release": rule.release,
+            "device_id": device_ids.get(actuator.topic_command),
+            "actuator": {
+                "id": str(actuator.id),
+                "name": actuator.name,
+                "command_topic": actuator.topic_command,
+                "status_topic": actuator.topic_status,
+            },
+        })
+    rule_engine.load(rules)
+    print(f"🤖 Regras de automação carregadas: {len(rules)}")
+
+CHANGE_SECTIONS = {"sensor": "sensors", "actuator": "actuators"}
+
+def apply_change(change):
+    """Apply a change delivered by the state store to this process' view."""
+    global state_version
+    change_type = change["type"]
+    if change_type == "registry":
+        reload_registry()
+        return
+    if change_type == "status":
+        # Only the process that sent the command has it pending
+        command_tracker.acknowledge(change["key"], change["data"]["active"], change["data"]["correlation_id"])
+        return
+    if change_type == "liveness":
+        apply_liveness(change)
+        return
+
+    version = change["version"]
+    data = change["data"]
+    with data_lock:
+        if change_type == "command":
+            command_history.append(dict(data, version=version))
+        else:
+            section = CHANGE_SECTIONS[change_type]
+            # Changes can arrive out of order; never replace a newer entry
+            if device_versions[section].get(change["key"], 0) >= version:
+                return
+            devices[section][change["key"]] = data
+            device_versions[section][change["key"]] = version
+            if section == "actuators":
+                actuator_keys_by_id[data["id"]] = change["key"]
+        state_version = max(state_version, version)
+        publish_state_snapshot(history=change_type == "command")
+
+    if change_type == "command":
+        broadcaster.publish("command", dict(data, version=version))
+    else:
+        broadcaster.publish(change_type, dict(data, key=change["key"], version=version))
+
+LIVENESS_LABELS = {"online": "online", "stale": "atrasado", "offline": "offline"}
+
+def sensor_liveness_changed(sensor_id, status, last_seen):
+    """Publish a liveness transition of this process' tracker to every process."""
+    sensor = read_snapshot["registry_sensors"].get(sensor_id, {})
+    print(f"📡 Sensor {sensor.get('name', sensor_id)} {LIVENESS_LABELS.get(status, status)}")
+    get_state_store().publish("liveness", sensor_id, {
+        "sensor_id": sensor_id,
+        "topic": sensor.get("topic"),
+        "status": status,
+        "seen_at": last_seen,
+        "last_seen": datetime.datetime.fromtimestamp(last_seen).strftime("%Y-%m-%d %H:%M:%S") if last_seen else None,
+    })
+
+def apply_liveness(change):
+    global state_version
+    data = dict(change["data"], version=change["version"])
+    sensor_id = data["sensor_id"]
+    with data_lock:
+        # Transitions can be delivered out of order; keep the latest one
+        current = sensor_liveness.get(sensor_id)
+        if current is not None and liveness_order(current["seen_at"], current["status"]) >= liveness_order(data["seen_at"], data["status"]):
+            return
+        sensor_liveness[sensor_id] = data
+        state_version = max(state_version, change["version"])
+        publish_liveness_snapshot()
+    update_registry_snapshot("registry_sensors", sensor_id, status=data["status"], last_seen=data["last_seen"])
+    broadcaster.publish("liveness", data)
+
+def get_state_store():
+    """This process' state store, created and connected to apply_change on first use."""
+    global state_store
+    if state_store is None:
+        with state_store_lock:
+            if state_store is None:
+                store = create_state_store(IOT_STATE_STORE_URL)
+                store.add_listener(apply_change)
+                state_store = store
+    return state_store
+
+def get_state_epoch():
+    return get_state_store().epoch
+
+def sync_shared_state():
+    """Start receiving changes from the state store and load its snapshot.
+
+    Returns False when the store has no shared snapshot (single process).
+    """
+    store = get_state_store()
+    if IOT_ROLE != "all" and isinstance(store, LocalStateStore):
+        print(f"⚠️ IOT_ROLE={IOT_ROLE} sem IOT_STATE_STORE_URL: o estado não será compartilhado entre processos")
+    store.start()
+    changes = store.load_snapshot()
+    if changes is None:
+        return False
+    with data_lock:
+        command_history.clear()
+        publish_state_snapshot(history=True)
+    for change in changes:
+        apply_change(change)
+    return True
+
+def get_state_version():
+    return read_snapshot["version"]
+
+def get_changes_since(snapshot, since):
+    """Return the entries of `snapshot` changed after version `since`."""
+    versions = snapshot["device_versions"]
+    sensors = {key: sensor for key, sensor in snapshot["sensors"].items()
+               if versions["sensors"].get(key, 0) > since}
+    actuators = {key: actuator for key, actuator in snapshot["actuators"].items()
+                 if versions["actuators"].get(key, 0) > since}
+    history = [entry for entry in snapshot["command_history"] if entry.get("version", 0) > since]
+    liveness = {sensor_id: entry for sensor_id, entry in snapshot["liveness"].items() if entry["version"] > since}
+    return sensors, actuators, history, liveness
+
+def recent_commands(limit=10, snapshot=None):
+    history = (snapshot or read_snapshot)["command_history"]
+    return list(history[-limit:])
+
+def find_actuator(actuator_id):
+    """Return (key, entry) for an actuator id, or (None, None). Caller must hold `data_lock`."""
+    key = actuator_keys_by_id.get(actuator_id)
+    if key is None:
+        return None, None
+    return key, devices["actuators"].get(key)
+
+def send_actuator_command(actuator_id, mqtt_payload, user, correlate=True, changes=None):
+    """Publish ON/OFF to an actuator, track it until acknowledged and log it.
+
+    Returns (actuator, requested_state, command), or None if the actuator is
+    unknown. The reported state only changes once the device confirms it,
+    except for actuators without a status topic. Raw commands
+    (`correlate=False`) are sent as plain ON/OFF. Caller must hold `data_lock`.
+    With a `changes` list, the state store changes are appended to it for the
+    caller to publish_changes() once it released the lock.
+    """
+    actuator_key, actuator = find_actuator(actuator_id)
+    if not actuator or not actuator.get("command_topic"):
+        return None
+    command = command_tracker.send(actuator, mqtt_payload, correlate)
+    requested_state = "Ligado" if mqtt_payload == "ON" else "Desligado"
+    if actuator.get("status_topic"):
+        entry = dict(actuator, pending_state=requested_state, command_id=command["id"], command_status=command["status"])
+    else:
+        entry = dict(actuator, state=requested_state)
+    own_changes = [] if changes is None else changes
+    own_changes.append(("actuator", actuator_key, entry))
+    own_changes.append(("command", None, record_command(actuator, requested_state, command["payload"], user, publish=False)))
+    if changes is None:
+        publish_changes(own_changes)
+    return actuator, requested_state, command
+
+def publish_changes(changes):
+    """Publish (change_type, key, data) changes collected by send_actuator_command."""
+    for change_type, key, data in changes:
+        get_state_store().publish(change_type, key, data)
+
+def run_rule_actions(actions):
+    """Issue the commands produced by the rule engine, straight from the ingest path."""
+    for rule, mqtt_payload in actions:
+        rule_commands.inc((rule["name"],))
+        print(f"🤖 Regra '{rule['name']}': {rule['actuator']['name']} -> {mqtt_payload}")
+        if rule["device_id"]:
+            with data_lock:
+                sent = send_actuator_command(rule["device_id"], mqtt_payload, RULE_COMMAND_USER)
+            if sent:
+                continue
+        command = command_tracker.send(rule["actuator"], mqtt_payload)
+        record_command(rule["actuator"], "Ligado" if mqtt_payload == "ON" else "Desligado",
+                       command["payload"], RULE_COMMAND_USER)
+
+def command_resolved(command):
+    """Publish the outcome of a tracked command (acknowledged or timed out)."""
+    command_results.inc((command["status"],))
+    with data_lock:
+        actuator_key, actuator = find_actuator(command["actuator_id"])
+        # A newer command for the same actuator owns the pending fields now
+        if not actuator or actuator.get("command_id") != command["id"]:
+            return
+        entry = dict(actuator, pending_state=None, command_status=command["status"])
+        if command["status"] == COMMAND_ACKED:
+            entry["state"] = "Ligado" if command["target_active"] else "Desligado"
+    get_state_store().publish("actuator", actuator_key, entry)
+
+def record_command(actuator, command, payload, user, publish=True):
+    """Log a command sent to `actuator` (persisted and shared with every process)."""
+    now = datetime.datetime.now()
+    entry = {
+        "timestamp": now.strftime(TIMESTAMP_FORMAT),
+        "user": user,
+        "actuator_id": actuator["id"],
+        "actuator_name": actuator.get("name", actuator["id"]),
+        "command": command,
+        "topic": actuator["command_topic"],
+        "payload": payload
+    }
+    write_buffer.append(CommandLog, dict(entry, timestamp=now))
+    if publish:
+        get_state_store().publish("command", None, entry)
+    return entry
+
+def load_command_history():
+    """Warm the in-memory history from the database (needs an app context)."""
+    with data_lock:
+        command_history.clear()
+        for command in CommandLog.get_recent_commands(COMMAND_HISTORY_CACHE_SIZE):
+            command_history.append(command.to_dict())
+        publish_state_snapshot(history=True)
+
+def update_sensor_state(topic, value, timestamp, **extra):
+    """Apply a reading to the matching `devices` entries through the state store."""
+    with data_lock:
+        changes = [(key, dict(sensor, value=value, timestamp=timestamp, **extra))
+                   for key, sensor in devices["sensors"].items() if sensor["topic"] == topic]
+    for key, entry in changes:
+        get_state_store().publish("sensor", key, entry)
+
+def update_actuator_state(topic, state):
+    with data_lock:
+        changes = [(key, dict(actuator, state=state))
+                   for key, actuator in devices["actuators"].items()
+                   if actuator["status_topic"] == topic and actuator["state"] != state]
+    for key, entry in changes:
+        get_state_store().publish("actuator", key, entry)
+
+def sync_subscriptions():
+    """Bring the broker subscriptions in line with the routing table.
+
+    Only the difference is sent, in multi-topic SUBSCRIBE/UNSUBSCRIBE
+    packets of up to SUBSCRIBE_BATCH_SIZE filters.
+    """
+    global subscribed_filters
+    # Only the process that owns ingest holds MQTT subscriptions
+    if not INGEST_ENABLED:
+        return
+    started = time.perf_counter()
+    plan = plan_subscriptions(topic_router.routes(), MQTT_SUBSCRIPTION_QOS, MQTT_WILDCARD_MIN_TOPICS)
+    if MQTT_SHARED_GROUP:
+        plan = {f"$share/{MQTT_SHARED_GROUP}/{topic_filter}": qos for topic_filter, qos in plan.items()}
+    with subscription_lock:
+        removed = [topic_filter for topic_filter in subscribed_filters if topic_filter not in plan]
+        added = [(topic_filter, qos) for topic_filter, qos in plan.items() if subscribed_filters.get(topic_filter) != qos]
+        packets = 0
+        for filters in batched(removed):
+            mqtt_client.unsubscribe(filters)
+            packets += 1
+        for filters in batched(added):
+            mqtt_client.subscribe(filters)
+            packets += 1
+        subscribed_filters = plan
+    if packets:
+        print(f"🔔 Assinaturas MQTT: +{len(added)} -{len(removed)} filtros em {packets} pacotes "
+              f"({len(plan)} filtros para {len(topic_router)} rotas, {(time.perf_counter() - started) * 1000:.1f} ms)")
+
+def registry_changed():
+    """Tell every process that sensors, actuators or rules were added, edited or removed."""
+    if INGEST_ENABLED:
+        rebuild_registry_snapshot()
+        prune_sensor_state(set(read_snapshot["registry_sensors"]))
+        load_rules()
+        sync_subscriptions()
+    else:
+        get_state_store().publish("registry", None, {})
+
+def reload_registry():
+    if flask_app is None:
+        return
+    with flask_app.app_context():
+        load_routes()
+    sync_subscriptions()
+
+def message_priority(topic):
+    for route in topic_router.match(topic):
+        if route["kind"] == "actuator":
+            return 1
+    return 0
+
 def on_message(client, userdata, msg):
     if flask_app is None:
         print("⚠️ Ignorando mensagem - Flask app não configurada!")
         return
-        
-    topic = msg.topic
-    payload = msg.payload.decode("utf-8").strip().upper()
-    
-    with flask_app.app_context():
-        print(f"📨 Mensagem recebida: {topic} = {payload}")
-        
-        sensor = Sensor.query.filter_by(topic=topic).first()
-        if sensor:
-            try:
-                sensor.value = float(payload)
-                db.session.commit()
-                print(f"📊 Sensor {sensor.name} atualizado: {payload}")
-                return
-            except ValueError:
-                print(f"⚠️ Valor inválido para sensor: {payload}")
-                pass
-        
-
-        actuator = Actuator.query.filter_by(topic_status=topic).first()
-        if actuator:
-            actuator.is_active = (payload == "ON")
-            db.session.commit()
-            print(f"⚙️ Atuador {actuator.name} atualizado: {'ON' if actuator.is_active else 'OFF'}")
-            return
 
-    print(f"⚠️ Tópico não tratado: {topic} / Payload: {payload}")
+    # Runs on the paho network thread: decode and hand off, nothing else
+    with mqtt_on_message_seconds.time():
+        payload = msg.payload.decode("utf-8").strip()
+        ingest_queue.put(msg.topic, payload, datetime.datetime.now())
+
+def on_disconnect(client, userdata, flags, rc, properties=None):
+    mqtt_disconnects.inc()
+    print(f"🔌 Desconectado do broker MQTT (código {rc})")
+
+def within_deadband(sensor_id, value, received_at):
+    """True if the reading adds nothing over the last stored one for this sensor."""
+    deadband = sensor_deadbands.get(sensor_id)
+    last = last_stored_readings.get(sensor_id)
+    if deadband is None or last is None:
+        return False
+    deadband_abs, deadband_pct, max_silence = deadband
+    last_value, last_timestamp = last
+    if max_silence and (received_at - last_timestamp).total_seconds() >= max_silence:
+        return False
+    difference = abs(value - last_value)
+    return difference == 0 or difference < max(deadband_abs, abs(last_value) * deadband_pct / 100)
+
+def update_sensor_statistics(sensor_id, value, timestamp):
+    """Fold a reading into the sensor's running statistics.
+
+    Returns (stats, zscore), zscore being None unless the reading is an
+    anomaly. The reading is judged against the statistics before it.
+    """
+    stats = sensor_statistics.get(sensor_id)
+    if stats is None:
+        stats = sensor_statistics[sensor_id] = RunningStats()
+    zscore = stats.zscore(value) if stats.count >= ANOMALY_MIN_SAMPLES else None
+    stats.update(value, timestamp, STATS_EWMA_ALPHA)
+    if zscore is None or abs(zscore) <= ANOMALY_SIGMAS:
+        return stats, None
+    return stats, zscore
+
+def store_sensor_reading(topic, routes, value, received_at):
+    """Persist one reading for the sensor routes of `topic` and run its rules.
+
+    Readings inside a sensor's deadband skip the database and the change
+    notifications, but rules, liveness and statistics still see every value.
+    Anomalies are always stored.
+    """
+    latest = None
+    for route in routes:
+        liveness.seen(route["id"])
+        stats, zscore = update_sensor_statistics(route["id"], value, received_at)
+        anomaly = zscore is not None
+        if anomaly:
+            sensor_anomalies.inc((route["name"],))
+            print(f"🚨 Leitura anômala do sensor {route['name']}: {value} ({zscore:+.1f} σ)")
+        elif within_deadband(route["id"], value, received_at):
+            suppressed_readings.inc((route["name"],))
+            continue
+        last_stored_readings[route["id"]] = (value, received_at)
+        latest = {"stats": stats.to_dict(), "anomaly": anomaly}
+        write_buffer.put(Sensor, route["id"], dict(stats.columns(), value=value))
+        update_registry_snapshot("registry_sensors", route["id"], value=value, timestamp=received_at, **latest)
+        write_buffer.append(SensorReading, {"sensor_id": route["id"], "value": value, "timestamp": received_at,
+                                            "anomaly": anomaly})
+        print(f"📊 Sensor {route['name']} atualizado: {value}")
+    if latest:
+        update_sensor_state(topic, value, received_at.strftime("%Y-%m-%d %H:%M:%S"), **latest)
+    actions = [action for route in routes for action in rule_engine.evaluate(route["id"], value)]
+    if actions:
+        run_rule_actions(actions)
+
+def process_batch(topic, payload, received_at):
+    """Split a batch by reading topic and queue each part on that topic's worker.
+
+    A sensor's deadband, statistics and rule state belong to the worker of its
+    topic, so the batch topic's worker must not apply the readings itself.
+    """
+    try:
+        readings = parse_batch_payload(payload, received_at)
+    except ValueError as e:
+        print(f"⚠️ Lote inválido em {topic}: {e}")
+        return
+    by_topic = {}
+    for reading_topic, value, timestamp in readings:
+        by_topic.setdefault(reading_topic, []).append((value, timestamp))
+    for reading_topic, topic_readings in by_topic.items():
+        ingest_queue.put(reading_topic, topic_readings, received_at, handler=store_batch_readings)
+    batch_readings.observe(len(readings))
+
+def store_batch_readings(topic, readings, received_at):
+    """Apply the [(value, timestamp), ...] readings of one topic from a batch, oldest first."""
+    routes = [route for route in topic_router.match(topic) if route["kind"] == "sensor"]
+    if not routes:
+        print(f"⚠️ Leitura para tópico não registrado: {topic}")
+        return
+    for value, timestamp in readings:
+        store_sensor_reading(topic, routes, value, timestamp)
+
+def process_message(topic, payload, received_at):
+    started = time.perf_counter()
+    print(f"📨 Mensagem recebida: {topic} = {payload}")
+
+    routes = topic_router.match(topic)
+    if not routes:
+        mqtt_messages.inc(("unrouted",))
+        print(f"⚠️ Tópico não tratado: {topic} / Payload: {payload}")
+        return
+    topic_class = routes[0]["kind"]
+    mqtt_messages.inc((topic_class,))
+
+    # Persistence is write-behind: updates are coalesced and flushed in batches
+    if topic_class == "batch":
+        process_batch(topic, payload, received_at)
+    sensor_routes = [route for route in routes if route["kind"] == "sensor"]
+    if sensor_routes:
+        try:
+            value = parse_sensor_value(payload)
+        except ValueError:
+            print(f"⚠️ Valor inválido para sensor: {payload}")
+        else:
+            store_sensor_reading(topic, sensor_routes, value, received_at)
+    actuator_state = None
+    for route in routes:
+        if route["kind"] == "actuator":
+            is_active, correlation_id = parse_status_payload(payload)
+            write_buffer.put(Actuator, route["id"], {"is_active": is_active})
+            update_registry_snapshot("registry_actuators", route["id"], is_active=is_active)
+            actuator_state = "Ligado" if is_active else "Desligado"
+            print(f"⚙️ Atuador {route['name']} atualizado: {'ON' if is_active else 'OFF'}")
+
+    if actuator_state is not None:
+        update_actuator_state(topic, actuator_state)
+        get_state_store().publish("status", topic, {"active": actuator_state == "Ligado", "correlation_id": correlation_id})
+
+    ingest_process_seconds.observe(time.perf_counter() - started, (topic_class,))
+    ingest_latency_seconds.observe((datetime.datetime.now() - received_at).total_seconds())
+
+PROCESS_STARTED = time.time()
+
+def consumer_status():
+    """This ingest process's counters, as reported to the state store."""
+    queue = ingest_queue.stats()
+    buffer = write_buffer.stats()
+    return {
+        "pid": os.getpid(),
+        "group": MQTT_SHARED_GROUP,
+        "connected": mqtt_client.is_connected(),
+        "uptime_seconds": round(time.time() - PROCESS_STARTED, 1),
+        "subscriptions": len(subscribed_filters),
+        "messages": mqtt_messages.total(),
+        "processed": queue["processed"],
+        "dropped": queue["dropped"],
+        "queue_depth": queue["depth"],
+        "rows_flushed": buffer["rows_flushed"],
+        "failed_flushes": buffer["failed_flushes"],
+        "pending_rows": buffer["pending"],
+    }
+
+def ingest_status_reporter():
+    while True:
+        try:
+            get_state_store().report_status(INGEST_CONSUMER_NAME, consumer_status(), INGEST_STATUS_INTERVAL * 3)
+        except Exception as e:
+            print(f"⚠️ Erro ao reportar o status da ingestão: {e}")
+        time.sleep(INGEST_STATUS_INTERVAL)
+
+# Summed across consumers; the rest describe a single process
+CONSUMER_TOTAL_FIELDS = ("messages", "processed", "dropped", "queue_depth", "rows_flushed", "failed_flushes", "pending_rows")
+
+def ingest_status():
+    """Every live ingest consumer's last report, plus totals across them."""
+    statuses = get_state_store().load_statuses()
+    consumers = [dict(status, name=name) for name, status in sorted(statuses.items())]
+    totals = {field: sum(status.get(field, 0) for status in consumers) for field in CONSUMER_TOTAL_FIELDS}
+    totals["consumers"] = len(consumers)
+    totals["connected"] = sum(1 for status in consumers if status.get("connected"))
+    return {"consumers": consumers, "totals": totals}
 
 def mqtt_thread_worker():
     print("🚀 Starting MQTT thread...")
@@ -151,6 +946,8 @@ def mqtt_thread_worker():
         except Exception as e:
             print(f"⚠️ MQTT error: {e}. Reconnecting in 5 seconds...")
             time.sleep(5)
+            mqtt_reconnects.inc()
             
 mqtt_client.on_connect = on_connect
 mqtt_client.on_message = on_message
+mqtt_client.on_disconnect = on_disconnect
@@ -0,0 +1,152 @@
+import json
+import threading
+import time
+import uuid
+
+# A change is a dict {"type": "sensor" | "actuator" | "liveness" | "command" |
+# "registry", "key": ..., "data": <entry>, "version": <int>}. Stores assign the
+# version and deliver every change to the listeners of every process sharing
+# the store.
+#
+# Stores also keep the latest status report of each ingest consumer, which
+# expires when the consumer stops reporting.
+
+# Change types whose latest entry per key is kept for the snapshot, and the
+# Redis hash holding them
+STORED_CHANGE_TYPES = {"sensor": "sensors", "actuator": "actuators", "liveness": "liveness"}
+
+
+class LocalStateStore:
+    """In-process store, used when web and ingest run in the same process.
+
+    Also serves as the stand-in for the shared store in tests.
+    """
+
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()
+        self._version = 0
+        self._listeners = []
+        self._statuses = {}
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def start(self):
+        pass
+
+    def report_status(self, name, status, ttl):
+        with self._lock:
+            self._statuses[name] = (time.time() + ttl, status)
+
+    def load_statuses(self):
+        now = time.time()
+        with self._lock:
+            self._statuses = {name: entry for name, entry in self._statuses.items() if entry[0] > now}
+            return {name: status for name, (expires_at, status) in self._statuses.items()}
+
+    def publish(self, change_type, key, data):
+        with self._lock:
+            self._version += 1
+            change = {"type": change_type, "key": key, "data": data, "version": self._version}
+        for listener in self._listeners:
+            listener(change)
+        return change["version"]
+
+    def load_snapshot(self):
+        # Nothing is shared: this process' own view is already authoritative
+        return None
+
+
+class RedisStateStore:
+    """Store shared by several processes through Redis.
+
+    Current device entries live in hashes and the recent command history in a
+    capped list, so a starting worker can load a snapshot; every change is
+    also sent on a pub/sub channel that each process applies to its local view.
+    """
+
+    def __init__(self, url, prefix="iot", history_size=50):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("O pacote 'redis' é necessário para IOT_STATE_STORE_URL=redis://...") from e
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.history_size = history_size
+        self.channel = f"{prefix}:changes"
+        self._listeners = []
+        self._thread = None
+        # The first process to start defines the epoch for the whole deployment
+        self._redis.set(f"{prefix}:epoch", uuid.uuid4().hex[:12], nx=True)
+        self.epoch = self._redis.get(f"{prefix}:epoch")
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._listen, name="state-store", daemon=True)
+        self._thread.start()
+
+    def _listen(self):
+        while True:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    change = json.loads(message["data"])
+                    for listener in self._listeners:
+                        listener(change)
+            except Exception as e:
+                print(f"⚠️ Erro no canal de estado compartilhado: {e}. Reconectando em 5 segundos...")
+                time.sleep(5)
+            finally:
+                pubsub.close()
+
+    def publish(self, change_type, key, data):
+        version = self._redis.incr(f"{self.prefix}:version")
+        change = {"type": change_type, "key": key, "data": data, "version": version}
+        encoded = json.dumps(change, default=str)
+        pipe = self._redis.pipeline()
+        if change_type == "command":
+            pipe.lpush(f"{self.prefix}:commands", encoded)
+            pipe.ltrim(f"{self.prefix}:commands", 0, self.history_size - 1)
+        elif change_type in STORED_CHANGE_TYPES:
+            pipe.hset(f"{self.prefix}:{STORED_CHANGE_TYPES[change_type]}", key, encoded)
+        pipe.publish(self.channel, encoded)
+        pipe.execute()
+        return version
+
+    def report_status(self, name, status, ttl):
+        self._redis.hset(f"{self.prefix}:consumers", name, json.dumps({"expires_at": time.time() + ttl, "status": status}))
+
+    def load_statuses(self):
+        statuses, expired = {}, []
+        now = time.time()
+        for name, encoded in self._redis.hgetall(f"{self.prefix}:consumers").items():
+            entry = json.loads(encoded)
+            if entry["expires_at"] > now:
+                statuses[name] = entry["status"]
+            else:
+                expired.append(name)
+        if expired:
+            self._redis.hdel(f"{self.prefix}:consumers", *expired)
+        return statuses
+
+    def load_snapshot(self):
+        """Return the stored changes: current device entries, then commands oldest first."""
+        changes = []
+        for hash_name in STORED_CHANGE_TYPES.values():
+            for encoded in self._redis.hgetall(f"{self.prefix}:{hash_name}").values():
+                changes.append(json.loads(encoded))
+        for encoded in reversed(self._redis.lrange(f"{self.prefix}:commands", 0, -1)):
+            changes.append(json.loads(encoded))
+        return changes
+
+
+def create_state_store(url=None):
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStateStore(url)
+    return LocalStateStore()
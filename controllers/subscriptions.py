@@ -0,0 +1,56 @@
+from controllers.topic_router import TopicRouter
+
+SUBSCRIBE_BATCH_SIZE = 100
+
+
+def _is_wildcard(topic_filter):
+    return "+" in topic_filter or "#" in topic_filter
+
+
+def plan_subscriptions(routes, qos_by_kind, wildcard_min=0):
+    """Return {topic_filter: qos} covering every route with as few filters as the registry permits.
+
+    Each topic gets the highest QoS of the routes on it. With `wildcard_min`
+    > 1, exact topics that differ in a single level (never the first) are
+    folded into a `+` filter once at least `wildcard_min` registered topics
+    share it; messages for unregistered topics under that filter are dropped
+    by the routing table. Exact topics already covered by a wildcard route
+    are not subscribed separately.
+    """
+    wanted = {}
+    for route in routes:
+        if route["topic"]:
+            wanted[route["topic"]] = max(wanted.get(route["topic"], 0), qos_by_kind.get(route["kind"], 0))
+    wildcards = {topic: qos for topic, qos in wanted.items() if _is_wildcard(topic)}
+    exact = {topic: qos for topic, qos in wanted.items() if not _is_wildcard(topic)}
+
+    if wildcard_min > 1:
+        candidates = {}
+        for topic in exact:
+            levels = topic.split("/")
+            for index in range(1, len(levels)):
+                candidate = "/".join(levels[:index] + ["+"] + levels[index + 1:])
+                candidates.setdefault(candidate, []).append(topic)
+        # Largest groups first; a topic folded into one filter leaves the others
+        for candidate, topics in sorted(candidates.items(), key=lambda item: -len(item[1])):
+            remaining = [topic for topic in topics if topic in exact]
+            if len(remaining) >= wildcard_min:
+                wildcards[candidate] = max(wildcards.get(candidate, 0), max(exact.pop(topic) for topic in remaining))
+
+    matcher = TopicRouter()
+    for topic_filter in wildcards:
+        matcher.add_route(topic_filter, "filter", topic_filter)
+    plan = dict(wildcards)
+    for topic, qos in exact.items():
+        covering = [route["id"] for route in matcher.match(topic)]
+        for topic_filter in covering:
+            plan[topic_filter] = max(plan[topic_filter], qos)
+        if not covering:
+            plan[topic] = qos
+    return plan
+
+
+def batched(items, size=SUBSCRIBE_BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
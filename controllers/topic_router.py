@@ -0,0 +1,107 @@
+import threading
+
+SINGLE_LEVEL_WILDCARD = "+"
+MULTI_LEVEL_WILDCARD = "#"
+
+
+class TopicRouter:
+    """In-memory routing table from MQTT topic filters to registered devices.
+
+    Exact topics are resolved with a single dict lookup; filters containing
+    `+`/`#` live in a trie keyed by topic level, so a match only walks the
+    levels of the incoming topic instead of every registered filter.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._exact = {}
+        self._wildcard_root = {"children": {}, "routes": {}}
+        self._by_device = {}
+
+    def add_route(self, topic_filter, kind, device_id, name=None):
+        key = (kind, device_id)
+        route = {"kind": kind, "id": device_id, "name": name, "topic": topic_filter}
+        with self._lock:
+            self._remove_locked(key)
+            if not topic_filter:
+                return
+            if SINGLE_LEVEL_WILDCARD in topic_filter or MULTI_LEVEL_WILDCARD in topic_filter:
+                node = self._wildcard_root
+                for level in topic_filter.split("/"):
+                    node = node["children"].setdefault(level, {"children": {}, "routes": {}})
+                node["routes"][key] = route
+            else:
+                self._exact.setdefault(topic_filter, {})[key] = route
+            self._by_device[key] = route
+
+    def remove_route(self, kind, device_id):
+        with self._lock:
+            return self._remove_locked((kind, device_id))
+
+    def _remove_locked(self, key):
+        route = self._by_device.pop(key, None)
+        if route is None:
+            return None
+        topic_filter = route["topic"]
+        if topic_filter in self._exact:
+            self._exact[topic_filter].pop(key, None)
+            if not self._exact[topic_filter]:
+                del self._exact[topic_filter]
+        else:
+            path = []
+            node = self._wildcard_root
+            for level in topic_filter.split("/"):
+                path.append((node, level))
+                node = node["children"][level]
+            node["routes"].pop(key, None)
+            # Prune empty branches so the trie does not grow with churn
+            for parent, level in reversed(path):
+                child = parent["children"][level]
+                if child["routes"] or child["children"]:
+                    break
+                del parent["children"][level]
+        return route
+
+    def clear(self):
+        with self._lock:
+            self._exact = {}
+            self._wildcard_root = {"children": {}, "routes": {}}
+            self._by_device = {}
+
+    def get_route(self, kind, device_id):
+        return self._by_device.get((kind, device_id))
+
+    def routes(self):
+        with self._lock:
+            return list(self._by_device.values())
+
+    def topics(self):
+        with self._lock:
+            return sorted({route["topic"] for route in self._by_device.values()})
+
+    def match(self, topic):
+        """Return every route whose filter matches `topic`."""
+        with self._lock:
+            matches = list(self._exact.get(topic, {}).values())
+            if self._wildcard_root["children"]:
+                levels = topic.split("/")
+                # Wildcards at the first level must not match $SYS-style topics
+                allow_wildcard = not topic.startswith("$")
+                self._match_node(self._wildcard_root, levels, 0, allow_wildcard, matches)
+            return matches
+
+    def _match_node(self, node, levels, index, allow_wildcard, matches):
+        children = node["children"]
+        if allow_wildcard and MULTI_LEVEL_WILDCARD in children:
+            matches.extend(children[MULTI_LEVEL_WILDCARD]["routes"].values())
+        if index == len(levels):
+            matches.extend(node["routes"].values())
+            return
+        level = levels[index]
+        if level in children:
+            self._match_node(children[level], levels, index + 1, True, matches)
+        if allow_wildcard and SINGLE_LEVEL_WILDCARD in children:
+            self._match_node(children[SINGLE_LEVEL_WILDCARD], levels, index + 1, True, matches)
+
+    def __len__(self):
+        return len(self._by_device)
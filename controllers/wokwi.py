@@ -1,5 +1,6 @@
 # MicroPython code for ESP32 in Wokwi
 # This code connects to WiFi, an MQTT broker, publishes sensor data (temperature and humidity),
+# buffering readings while offline and reporting only changes beyond a deadband plus a periodic heartbeat,
 # and subscribes to topics to control actuators (Ventilador, Mangueira de água) based on commands from the dashboard.
 
 from machine import Pin, PWM
@@ -8,7 +9,7 @@ import time
 import network
 from umqtt.simple import MQTTClient
 import ubinascii
-import json # For potential future use with JSON payloads
+import json # Command/status payloads
 
 # --- Configuration ---
 # WiFi Credentials (Wokwi uses Wokwi-GUEST with no password)
@@ -28,6 +29,12 @@ TOPIC_SENSOR_HUMIDITY = b"iot/sensor/umidade"
 
 TOPIC_ACTUATOR_VENTILADOR_CMD = b"iot/actuator/Ventilador/command"
 TOPIC_ACTUATOR_MANGUEIRA_CMD = b"iot/actuator/Mangueira_de_agua/command" # Note: 'Mangueira_de_agua' to match dashboard's JS topic generation
+TOPIC_ACTUATOR_VENTILADOR_STATUS = b"iot/actuator/Ventilador/status"
+TOPIC_ACTUATOR_MANGUEIRA_STATUS = b"iot/actuator/Mangueira_de_agua/status"
+# Batched readings: {"now": <device clock>, "r": [[topic, value, ts], ...]} in one message.
+# The dashboard places `ts` relative to `now`, so the clock does not need NTP.
+TOPIC_BATCH = b"iot/batch/" + CLIENT_ID.encode()
+USE_BATCH_PAYLOAD = True  # False publishes one plain-text message per sensor (replayed readings lose their timestamp)
 
 # --- Hardware Pins ---
 # Actuators
@@ -39,10 +46,110 @@ servo = PWM(mangueira_servo_pin, freq=50)
 dht_sensor_pin = Pin(21)
 dht_sensor = dht.DHT11(dht_sensor_pin)
 
+# --- Reporting ---
+SENSOR_SAMPLE_INTERVAL = 5  # seconds between sensor reads
+HEARTBEAT_INTERVAL = 60     # report every sensor at least this often, even if unchanged
+# A reading is only reported when it moves at least this much from the last reported value
+DEADBAND = {
+    TOPIC_SENSOR_TEMP: 0.5,      # °C
+    TOPIC_SENSOR_HUMIDITY: 2.0,  # %
+}
+# Readings wait in a ring buffer until published; when full, the oldest are overwritten
+READING_BUFFER_SIZE = 720   # one hour of both sensors with no deadband suppression
+REPLAY_BATCH_SIZE = 20      # readings per published message
+REPLAY_BURSTS_PER_LOOP = 5  # messages per loop iteration while catching up
+REPLAY_BURST_PAUSE_MS = 50  # pause between messages so the broker is not flooded
+RECONNECT_INTERVAL = 10     # seconds between reconnection attempts
+
 # --- Global Variables ---
 mqtt_client = None
-last_sensor_publish_time = 0
-SENSOR_PUBLISH_INTERVAL = 5  # seconds
+last_sample_time = 0
+last_reconnect_time = 0
+last_reported = {}  # topic -> (value, time of report)
+
+# --- Reading Buffer ---
+class RingBuffer:
+    # Fixed-size FIFO: the list is allocated once, so buffering never fragments the heap
+    def __init__(self, size):
+        self._items = [None] * size
+        self._start = 0
+        self._count = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, item):
+        size = len(self._items)
+        if self._count == size:
+            self._start = (self._start + 1) % size
+            self.dropped += 1
+        else:
+            self._count += 1
+        self._items[(self._start + self._count - 1) % size] = item
+
+    def peek(self, count):
+        count = min(count, self._count)
+        size = len(self._items)
+        return [self._items[(self._start + i) % size] for i in range(count)]
+
+    def discard(self, count):
+        count = min(count, self._count)
+        size = len(self._items)
+        for i in range(count):
+            self._items[(self._start + i) % size] = None
+        self._start = (self._start + count) % size
+        self._count -= count
+
+reading_buffer = RingBuffer(READING_BUFFER_SIZE)
+
+# --- Sensor Publishing ---
+def publish_readings(readings):
+    # readings: list of (topic, value, timestamp) taken with time.time()
+    if USE_BATCH_PAYLOAD:
+        batch = {"now": time.time(), "r": [[topic.decode(), value, ts] for topic, value, ts in readings]}
+        mqtt_client.publish(TOPIC_BATCH, json.dumps(batch).encode())
+        print(f"Publicado lote com {len(readings)} leituras em {TOPIC_BATCH.decode()}")
+    else:
+        for topic, value, ts in readings:
+            mqtt_client.publish(topic, str(value).encode())
+            print(f"Publicado no tópico {topic.decode()}: {value}")
+
+def should_report(topic, value, now):
+    last = last_reported.get(topic)
+    if last is None:
+        return True
+    last_value, last_time = last
+    return abs(value - last_value) >= DEADBAND.get(topic, 0) or now - last_time >= HEARTBEAT_INTERVAL
+
+def sample_sensors(now):
+    try:
+        dht_sensor.measure()
+    except OSError as e:
+        # Sensor read errors must not be mistaken for a dropped connection
+        print(f"Erro ao ler o DHT: {e}")
+        return
+    temp = dht_sensor.temperature()
+    hum = dht_sensor.humidity()
+    print(f"Temperatura: {temp}°C, Umidade: {hum}%")
+    for topic, value in ((TOPIC_SENSOR_TEMP, temp), (TOPIC_SENSOR_HUMIDITY, hum)):
+        if should_report(topic, value, now):
+            reading_buffer.append((topic, value, now))
+            last_reported[topic] = (value, now)
+
+def flush_readings():
+    # Publish buffered readings oldest first, a few batches per call; a reading
+    # only leaves the buffer once its message was handed to the socket
+    for burst in range(REPLAY_BURSTS_PER_LOOP):
+        readings = reading_buffer.peek(REPLAY_BATCH_SIZE)
+        if not readings:
+            return
+        if burst:
+            time.sleep_ms(REPLAY_BURST_PAUSE_MS)
+        publish_readings(readings)
+        reading_buffer.discard(len(readings))
+    if len(reading_buffer):
+        print(f"Reenviando leituras pendentes: {len(reading_buffer)} no buffer")
 
 # --- Servo Control Functions (Mangueira) ---
 def abrir_mangueira():
@@ -54,26 +161,51 @@ def fechar_mangueira():
     print("Mangueira Fechada (Desligada)")
 
 # --- MQTT Callback Function ---
+def parse_command(msg):
+    # Commands are {"command": "ON", "id": "<correlation id>"} or plain ligar/desligar/ON/OFF
+    text = msg.decode().strip()
+    if text.startswith("{"):
+        try:
+            data = json.loads(text)
+            return str(data.get("command", "")).lower(), data.get("id")
+        except ValueError:
+            pass
+    return text.lower(), None
+
+def publish_status(topic, is_on, correlation_id):
+    # Echo the correlation id so the dashboard can acknowledge the command
+    status = {"state": "ON" if is_on else "OFF"}
+    if correlation_id:
+        status["id"] = correlation_id
+    try:
+        mqtt_client.publish(topic, json.dumps(status).encode())
+    except Exception as e:
+        print(f"Erro ao publicar status: {e}")
+
 def mqtt_subscription_callback(topic, msg):
     print(f"Received message: Topic='{topic.decode()}', Message='{msg.decode()}'")
-    command = msg.decode().lower()
+    command, correlation_id = parse_command(msg)
     topic_str = topic.decode()
 
     if topic_str == TOPIC_ACTUATOR_VENTILADOR_CMD.decode():
-        if command == "ligar":
+        if command in ("ligar", "on"):
             ventilador_pin.on()
             print("Ventilador Ligado")
-        elif command == "desligar":
+            publish_status(TOPIC_ACTUATOR_VENTILADOR_STATUS, True, correlation_id)
+        elif command in ("desligar", "off"):
             ventilador_pin.off()
             print("Ventilador Desligado")
+            publish_status(TOPIC_ACTUATOR_VENTILADOR_STATUS, False, correlation_id)
         else:
             print(f"Comando desconhecido para Ventilador: {command}")
 
     elif topic_str == TOPIC_ACTUATOR_MANGUEIRA_CMD.decode():
-        if command == "ligar":
+        if command in ("ligar", "on"):
             abrir_mangueira()
-        elif command == "desligar":
+            publish_status(TOPIC_ACTUATOR_MANGUEIRA_STATUS, True, correlation_id)
+        elif command in ("desligar", "off"):
             fechar_mangueira()
+            publish_status(TOPIC_ACTUATOR_MANGUEIRA_STATUS, False, correlation_id)
         else:
             print(f"Comando desconhecido para Mangueira: {command}")
     else:
@@ -120,23 +252,31 @@ def connect_mqtt():
         return False
 
 # --- Main Loop ---
+def reconnect(now):
+    # Rate-limited so a long outage keeps sampling instead of blocking on retries
+    global mqtt_client, last_reconnect_time
+    if now - last_reconnect_time < RECONNECT_INTERVAL:
+        return False
+    last_reconnect_time = now
+    mqtt_client = None
+    print(f"Tentando reconectar WiFi e MQTT... ({len(reading_buffer)} leituras no buffer)")
+    if connect_wifi() and connect_mqtt():
+        return True
+    mqtt_client = None
+    return False
+
 def main():
-    global last_sensor_publish_time
+    global last_sample_time
     global mqtt_client
 
     # Initial setup
     ventilador_pin.off()
     fechar_mangueira() # Start with mangueira closed
 
-    if not connect_wifi():
-        print("Não foi possível conectar ao WiFi. Reiniciando em 10s...")
-        time.sleep(10)
-        machine.reset() # Or handle error differently
-
-    if not connect_mqtt():
-        print("Não foi possível conectar ao MQTT. Reiniciando em 10s...")
-        time.sleep(10)
-        machine.reset() # Or handle error differently
+    # Readings are buffered while offline, so a failed first connection is not fatal
+    if not (connect_wifi() and connect_mqtt()):
+        print("Sem conexão no início; as leituras serão guardadas até reconectar.")
+        mqtt_client = None
 
     print("Setup completo. Iniciando loop principal...")
 
@@ -144,60 +284,27 @@ def main():
         try:
             current_time = time.time()
 
+            if (current_time - last_sample_time) >= SENSOR_SAMPLE_INTERVAL:
+                sample_sensors(current_time)
+                last_sample_time = current_time
+
+            if mqtt_client is None and not reconnect(current_time):
+                time.sleep(1)
+                continue
+
             # Check for incoming MQTT messages
-            if mqtt_client:
-                mqtt_client.check_msg()
-
-            # Publish sensor data periodically
-            if (current_time - last_sensor_publish_time) >= SENSOR_PUBLISH_INTERVAL:
-                dht_sensor.measure()
-                temp = dht_sensor.temperature()
-                hum = dht_sensor.humidity()
-                print(f"Temperatura: {temp}°C, Umidade: {hum}%")
-
-                if mqtt_client:
-                    try:
-                        mqtt_client.publish(TOPIC_SENSOR_TEMP, str(temp).encode())
-                        print(f"Publicado no tópico {TOPIC_SENSOR_TEMP.decode()}: {temp}°C")
-                        mqtt_client.publish(TOPIC_SENSOR_HUMIDITY, str(hum).encode())
-                        print(f"Publicado no tópico {TOPIC_SENSOR_HUMIDITY.decode()}: {hum}%")
-                        last_sensor_publish_time = current_time
-                    except Exception as e:
-                        print(f"Erro ao publicar dados dos sensores: {e}")
-                        # Attempt to reconnect if publishing fails
-                        print("Tentando reconectar ao MQTT...")
-                        if connect_mqtt():
-                            print("Reconectado ao MQTT com sucesso.")
-                        else:
-                            print("Falha ao reconectar ao MQTT. Tentando novamente no próximo ciclo.")
-                            time.sleep(5) # Wait before retrying connection in the main loop
-                            continue # Skip to next iteration to retry connection
-                else:
-                    print("Cliente MQTT não conectado. Tentando reconectar...")
-                    if connect_mqtt():
-                         print("Reconectado ao MQTT com sucesso.")
-                    else:
-                        print("Falha ao reconectar ao MQTT. Tentando novamente no próximo ciclo.")
-                        time.sleep(5)
-                        continue
+            mqtt_client.check_msg()
+            flush_readings()
 
             time.sleep(1)  # Main loop delay
 
         except OSError as e:
-            print(f"Erro de OSError no loop principal: {e}")
-            print("Tentando reconectar WiFi e MQTT...")
-            if connect_wifi():
-                connect_mqtt()
-            else:
-                print("Falha ao reconectar WiFi. Reiniciando em 10s...")
-                time.sleep(10)
-                machine.reset()
-            time.sleep(5) # wait before next loop iteration
+            print(f"Erro de conexão no loop principal: {e}")
+            mqtt_client = None
+            time.sleep(1)
         except Exception as e:
             print(f"Erro inesperado no loop principal: {e}")
             time.sleep(5)
-            # Consider a soft reset or more robust error handling here
-            # machine.reset()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,263 @@
+import threading
+import time
+from sqlalchemy import bindparam, insert, update
+from sqlalchemy.exc import DataError, IntegrityError
+from models.db import db
+
+
+class WriteBehindBuffer:
+    """Coalesces device updates in memory and persists them in batches.
+
+    Each (model, id) keeps only its latest values, while `append` rows (e.g.
+    time-series readings) are kept in order and bulk-inserted. A background
+    thread flushes every `flush_interval_ms`, or earlier once `max_dirty` rows
+    are pending, as one transaction. When `max_pending` rows are waiting, new
+    writes block until the next flush frees space.
+    """
+
+    def __init__(self, flush_interval_ms=250, max_dirty=500, max_pending=10000, max_retries=3):
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_dirty = max_dirty
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self._consecutive_failures = 0
+        self._app = None
+        self._pending = {}
+        self._appends = []
+        self._flush_hooks = []
+        self._flush_listeners = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._counters = {
+            "puts": 0,
+            "appends": 0,
+            "rows_inserted": 0,
+            "coalesced": 0,
+            "flushes": 0,
+            "failed_flushes": 0,
+            "dropped_rows": 0,
+            "rows_flushed": 0,
+            "last_flush_rows": 0,
+            "max_flush_rows": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    def set_app(self, app):
+        self._app = app
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flusher thread and persist whatever is still pending."""
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def add_flush_hook(self, hook):
+        """Call `hook(appended)` inside every flush transaction, before commit.
+
+        `appended` maps each model to the list of rows inserted by that flush.
+        """
+        self._flush_hooks.append(hook)
+
+    def add_flush_listener(self, listener):
+        """Call `listener(seconds, rows, ok)` after every flush transaction (e.g. metrics)."""
+        self._flush_listeners.append(listener)
+
+    def _notify_flush(self, seconds, rows, ok):
+        for listener in self._flush_listeners:
+            listener(seconds, rows, ok)
+
+    def put(self, model, device_id, values):
+        key = (model, device_id)
+        with self._cond:
+            if key not in self._pending:
+                self._wait_for_space()
+            self._counters["puts"] += 1
+            if key in self._pending:
+                self._pending[key].update(values)
+                self._counters["coalesced"] += 1
+            else:
+                self._pending[key] = dict(values)
+            self._notify_if_dirty()
+
+    def append(self, model, values):
+        with self._cond:
+            self._wait_for_space()
+            self._counters["appends"] += 1
+            self._appends.append((model, values))
+            self._notify_if_dirty()
+
+    def _wait_for_space(self):
+        while self._running and self.pending_count() >= self.max_pending:
+            self._cond.notify_all()
+            self._cond.wait(self.flush_interval)
+
+    def _notify_if_dirty(self):
+        if self.pending_count() >= self.max_dirty:
+            self._cond.notify_all()
+
+    def pending_count(self):
+        return len(self._pending) + len(self._appends)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats["pending"] = self.pending_count()
+        flushes = stats["flushes"]
+        stats["avg_flush_ms"] = stats["total_flush_ms"] / flushes if flushes else 0.0
+        stats["avg_flush_rows"] = stats["rows_flushed"] / flushes if flushes else 0.0
+        return stats
+
+    def _run(self):
+        while self._running:
+            # The thread must survive any error: writers block once max_pending is reached
+            try:
+                with self._cond:
+                    if self.pending_count() < self.max_dirty:
+                        self._cond.wait(self.flush_interval)
+                if self.pending_count():
+                    self.flush()
+            except Exception as e:
+                print(f"⚠️ Erro no buffer de escrita: {e}")
+                time.sleep(self.flush_interval)
+
+    def flush(self):
+        """Persist every pending row in a single transaction. Returns the row count.
+
+        If the database rejects the data itself (constraint or type errors,
+        e.g. a reading for a device deleted meanwhile), the batch is split in
+        halves until the offending rows are isolated; only those are dropped.
+        Other failures (connection lost, locks) requeue the batch, which is
+        dropped after `max_retries` consecutive failures so an outage cannot
+        wedge the buffer forever.
+        """
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, {}
+                appends, self._appends = self._appends, []
+                self._cond.notify_all()
+            if not batch and not appends:
+                return 0
+
+            rows = len(batch) + len(appends)
+            started = time.perf_counter()
+            try:
+                self._write(list(batch.items()), appends)
+            except (IntegrityError, DataError) as e:
+                print(f"⚠️ Banco rejeitou parte de {rows} escritas, isolando as linhas inválidas: {e.orig}")
+                with self._cond:
+                    self._counters["failed_flushes"] += 1
+                rows = self._write_isolating([("put", item) for item in batch.items()] +
+                                             [("append", item) for item in appends])
+            except Exception as e:
+                print(f"⚠️ Falha ao persistir {rows} escritas: {e}")
+                self._consecutive_failures += 1
+                with self._cond:
+                    self._counters["failed_flushes"] += 1
+                if self._consecutive_failures >= self.max_retries:
+                    with self._cond:
+                        self._counters["dropped_rows"] += rows
+                    self._consecutive_failures = 0
+                    print(f"🗑️ Descartando {rows} escritas após {self.max_retries} falhas")
+                else:
+                    self._requeue(batch, appends)
+                self._notify_flush(time.perf_counter() - started, rows, False)
+                return 0
+            self._consecutive_failures = 0
+
+            elapsed_ms = (time.perf_counter() - started) * 1000.0
+            with self._cond:
+                counters = self._counters
+                counters["flushes"] += 1
+                counters["rows_flushed"] += rows
+                counters["rows_inserted"] += len(appends)
+                counters["last_flush_rows"] = rows
+                counters["max_flush_rows"] = max(counters["max_flush_rows"], rows)
+                counters["last_flush_ms"] = elapsed_ms
+                counters["max_flush_ms"] = max(counters["max_flush_ms"], elapsed_ms)
+                counters["total_flush_ms"] += elapsed_ms
+            self._notify_flush(elapsed_ms / 1000.0, rows, True)
+            return rows
+
+    def _write(self, puts, appends):
+        """Write `puts` ([((model, id), values)]) and `appends` in one transaction."""
+        # One executemany per (table, column set); rows for devices deleted
+        # meanwhile simply match nothing instead of failing the batch.
+        groups = {}
+        for (model, device_id), values in puts:
+            columns = tuple(sorted(values))
+            row = {f"b_{column}": value for column, value in values.items()}
+            row["b_id"] = device_id
+            groups.setdefault((model, columns), []).append(row)
+        appended = {}
+        for model, values in appends:
+            appended.setdefault(model, []).append(values)
+
+        with self._app.app_context():
+            try:
+                for (model, columns), rows in groups.items():
+                    table = model.__table__
+                    statement = (
+                        update(table)
+                        .where(table.c.id == bindparam("b_id"))
+                        .values({column: bindparam(f"b_{column}") for column in columns})
+                    )
+                    db.session.execute(statement, rows)
+                for model, rows in appended.items():
+                    db.session.execute(insert(model.__table__), rows)
+                for hook in self._flush_hooks:
+                    hook(appended)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def _write_isolating(self, entries):
+        """Write `entries` ([("put" | "append", item)]) bisecting around rejected rows. Returns rows written."""
+        puts = [item for kind, item in entries if kind == "put"]
+        appends = [item for kind, item in entries if kind == "append"]
+        try:
+            self._write(puts, appends)
+            return len(entries)
+        except (IntegrityError, DataError) as e:
+            if len(entries) == 1:
+                if puts:
+                    (model, _device_id), values = puts[0]
+                else:
+                    model, values = appends[0]
+                print(f"🗑️ Descartando escrita rejeitada em {model.__tablename__}: {values} ({e.orig})")
+                with self._cond:
+                    self._counters["dropped_rows"] += 1
+                return 0
+        except Exception as e:
+            print(f"⚠️ Falha ao persistir {len(entries)} escritas: {e}")
+            self._requeue(dict(puts), appends)
+            return 0
+        middle = len(entries) // 2
+        return self._write_isolating(entries[:middle]) + self._write_isolating(entries[middle:])
+
+    def _requeue(self, batch, appends):
+        # Newer values that arrived during the failed flush win over the batch
+        with self._cond:
+            self._appends[:0] = appends
+            for key, values in batch.items():
+                if key in self._pending:
+                    merged = dict(values)
+                    merged.update(self._pending[key])
+                    self._pending[key] = merged
+                else:
+                    self._pending[key] = values
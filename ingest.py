@@ -0,0 +1,96 @@
+# Dedicated ingest process for multi-process deployments.
+#
+# Owns the MQTT subscriptions and the database writes of incoming messages,
+# and publishes device state to the shared store that the web workers
+# (IOT_ROLE=web) read from:
+#
+#   IOT_STATE_STORE_URL=redis://localhost:6379/0 python ingest.py
+#   IOT_STATE_STORE_URL=redis://localhost:6379/0 IOT_ROLE=web gunicorn -w 4 -k gthread --threads 32 wsgi:app
+#
+# With --consumers K it supervises K ingest processes joined to one MQTT
+# shared subscription ($share/<group>/...), so the broker spreads the
+# messages over K cores:
+#
+#   IOT_STATE_STORE_URL=redis://localhost:6379/0 python ingest.py --consumers 4
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+os.environ["IOT_ROLE"] = "ingest"
+
+DEFAULT_SHARED_GROUP = "iot-ingest"
+
+
+def exit_on_sigterm(signum, frame):
+    # Ignore repeats (e.g. one from the supervisor, one to the process group) while draining
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    sys.exit(0)
+
+
+def run_consumer():
+    from app import create_app, start_services  # reads IOT_ROLE at import
+
+    app = create_app()
+    start_services(app)
+    # Exit through atexit on SIGTERM, so the ingest queue drains and the buffer flushes
+    signal.signal(signal.SIGTERM, exit_on_sigterm)
+    print("📥 Processo de ingestão MQTT em execução")
+    while True:
+        time.sleep(3600)
+
+
+def run_supervisor(consumers, group):
+    """Start `consumers` ingest processes in one shared group and restart any that exit."""
+    if not os.environ.get("IOT_STATE_STORE_URL"):
+        print("⚠️ Sem IOT_STATE_STORE_URL, o estado e o status de cada consumidor ficam só no próprio processo")
+    # Deadband, running statistics and rule hysteresis are kept per process
+    print("⚠️ Configure o broker para distribuir o grupo por tópico (ex.: EMQX hash_topic): "
+          "banda morta, estatísticas e regras de um sensor dependem de um só consumidor")
+    from app import create_app, create_schema
+
+    # Once, before the consumers start: concurrent CREATE TABLEs on a fresh database collide
+    with create_app().app_context():
+        create_schema()
+
+    def spawn(index):
+        env = dict(os.environ, IOT_MQTT_SHARED_GROUP=group, IOT_INGEST_CONSUMER=f"{group}-{index}")
+        # A fresh interpreter per consumer: no threads or sockets inherited through fork
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+
+    children = {index: spawn(index) for index in range(consumers)}
+    print(f"📥 {consumers} consumidores de ingestão no grupo compartilhado '{group}'")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while not stopping:
+        time.sleep(1)
+        for index, child in children.items():
+            if child.poll() is not None and not stopping:
+                print(f"⚠️ Consumidor {index} saiu com código {child.returncode}; reiniciando")
+                children[index] = spawn(index)
+    for child in children.values():
+        child.terminate()
+    for child in children.values():
+        child.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the MQTT ingest process(es).")
+    parser.add_argument("--consumers", type=int, default=1,
+                        help="ingest processes sharing the subscriptions (default 1, no shared group)")
+    parser.add_argument("--group", default=os.environ.get("IOT_MQTT_SHARED_GROUP") or DEFAULT_SHARED_GROUP,
+                        help="MQTT shared subscription group used with --consumers > 1")
+    args = parser.parse_args()
+    if args.consumers > 1:
+        run_supervisor(args.consumers, args.group)
+    else:
+        run_consumer()
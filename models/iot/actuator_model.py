@@ -16,6 +16,7 @@ class Actuator(db.Model):
         actuator = Actuator(name = name, topic_command = topic_command, topic_status = topic_status, is_active = is_active, unit = unit)
         db.session.add(actuator)
         db.session.commit()
+        return actuator
 
     def get_actuators():
         actuators = Actuator.query.all()
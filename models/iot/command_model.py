@@ -0,0 +1,69 @@
+from models.db import db
+from sqlalchemy import and_, or_
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class CommandLog(db.Model):
+    __tablename__ = "command_history"
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    user = db.Column(db.String(30))
+    actuator_id = db.Column(db.String(100), nullable=False)
+    actuator_name = db.Column(db.String(100))
+    command = db.Column(db.String(50), nullable=False)
+    topic = db.Column(db.String(100))
+    payload = db.Column(db.String(100))
+
+    __table_args__ = (
+        db.Index("ix_command_history_actuator_timestamp", "actuator_id", "timestamp"),
+        db.Index("ix_command_history_user_timestamp", "user", "timestamp"),
+        db.Index("ix_command_history_timestamp", "timestamp"),
+    )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "timestamp": self.timestamp.strftime(TIMESTAMP_FORMAT),
+            "user": self.user,
+            "actuator_id": self.actuator_id,
+            "actuator_name": self.actuator_name,
+            "command": self.command,
+            "topic": self.topic,
+            "payload": self.payload,
+        }
+
+    def get_recent_commands(limit):
+        commands = (
+            CommandLog.query.order_by(CommandLog.timestamp.desc(), CommandLog.id.desc())
+            .limit(limit)
+            .all()
+        )
+        return list(reversed(commands))
+
+    def get_commands_page(limit, actuator_id=None, user=None, start=None, end=None, before=None):
+        """Return up to `limit` commands, newest first, using keyset pagination.
+
+        `before` is the (timestamp, id) of the last row of the previous page, so
+        each page is an index range scan no matter how deep the client pages.
+        """
+        query = CommandLog.query
+        if actuator_id:
+            query = query.filter(CommandLog.actuator_id == actuator_id)
+        if user:
+            query = query.filter(CommandLog.user == user)
+        if start is not None:
+            query = query.filter(CommandLog.timestamp >= start)
+        if end is not None:
+            query = query.filter(CommandLog.timestamp < end)
+        if before is not None:
+            before_timestamp, before_id = before
+            query = query.filter(or_(
+                CommandLog.timestamp < before_timestamp,
+                and_(CommandLog.timestamp == before_timestamp, CommandLog.id < before_id),
+            ))
+        return (
+            query.order_by(CommandLog.timestamp.desc(), CommandLog.id.desc())
+            .limit(limit)
+            .all()
+        )
@@ -0,0 +1,64 @@
+from models.db import db
+from sqlalchemy.sql import func
+
+RULE_OPERATORS = (">", "<")
+
+
+class AutomationRule(db.Model):
+    """Threshold rule with hysteresis: turns an actuator on past `threshold`
+    and off again once the reading crosses back past `release`.
+
+    With ">" (e.g. cooling) the actuator turns on above `threshold` and off
+    below `release`; with "<" (e.g. heating) on below `threshold` and off
+    above `release`.
+    """
+    __tablename__ = "automation_rules"
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    sensor_id = db.Column(db.Integer, db.ForeignKey("sensors.id", ondelete="CASCADE"), nullable=False)
+    actuator_id = db.Column(db.Integer, db.ForeignKey("Actuators.id", ondelete="CASCADE"), nullable=False)
+    operator = db.Column(db.String(1), nullable=False, default=">")
+    threshold = db.Column(db.Float, nullable=False)
+    release = db.Column(db.Float, nullable=False)
+    enabled = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+
+    def validate(operator, threshold, release):
+        """Return an error message, or None if the rule is consistent."""
+        if operator not in RULE_OPERATORS:
+            return "Operador inválido"
+        if operator == ">" and release > threshold:
+            return "Para '>', o valor de desligamento deve ser menor ou igual ao limite"
+        if operator == "<" and release < threshold:
+            return "Para '<', o valor de desligamento deve ser maior ou igual ao limite"
+        return None
+
+    def save_rule(name, sensor_id, actuator_id, operator, threshold, release):
+        rule = AutomationRule(name=name, sensor_id=sensor_id, actuator_id=actuator_id,
+                              operator=operator, threshold=threshold, release=release)
+        db.session.add(rule)
+        db.session.commit()
+        return rule
+
+    def get_rules():
+        return AutomationRule.query.order_by(AutomationRule.id).all()
+
+    def get_single_rule(id):
+        return AutomationRule.query.filter(AutomationRule.id == id).first()
+
+    def get_enabled_rules():
+        return AutomationRule.query.filter(AutomationRule.enabled.is_(True)).all()
+
+    def toggle_rule(id):
+        rule = AutomationRule.query.filter(AutomationRule.id == id).first()
+        if rule is not None:
+            rule.enabled = not rule.enabled
+            db.session.commit()
+        return rule
+
+    def delete_rule(id):
+        rule = AutomationRule.query.filter(AutomationRule.id == id).first()
+        if rule is not None:
+            db.session.delete(rule)
+            db.session.commit()
+        return rule
@@ -10,11 +10,24 @@ class Sensor(db.Model):
     value = db.Column(db.Float)
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
     updated_at = db.Column(db.DateTime(timezone=True), onupdate=func.now())
+    # Ingest deadband: a reading within max(deadband_abs, deadband_pct% of the last
+    # stored value) is not stored, unless max_silence seconds passed since the last
+    # stored one. All zero disables it; only max_silence drops exact duplicates.
+    deadband_abs = db.Column(db.Float, nullable=False, default=0.0, server_default="0")
+    deadband_pct = db.Column(db.Float, nullable=False, default=0.0, server_default="0")
+    max_silence = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    # Running statistics of the readings (controllers/sensor_stats.py), saved with
+    # each stored value so ingest resumes them after a restart
+    stats_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    stats_mean = db.Column(db.Float, nullable=False, default=0.0, server_default="0")
+    stats_m2 = db.Column(db.Float, nullable=False, default=0.0, server_default="0")
+    stats_ewma = db.Column(db.Float)
 
     def save_sensor(name, topic, unit):
         sensor = Sensor(name = name, topic = topic, unit = unit)
         db.session.add(sensor)
         db.session.commit()
+        return sensor
 
     def get_sensors():
         sensors = Sensor.query.all()
@@ -25,11 +38,14 @@ class Sensor(db.Model):
         return sensor
 
         
-    def update_sensor(id, name, unit):
+    def update_sensor(id, name, unit, deadband_abs=0.0, deadband_pct=0.0, max_silence=0):
         sensor = Sensor.query.filter(Sensor.id == id).first()
         if sensor is not None:
             sensor.name = name
             sensor.unit = unit
+            sensor.deadband_abs = deadband_abs
+            sensor.deadband_pct = deadband_pct
+            sensor.max_silence = max_silence
             db.session.commit()
             return Sensor.get_sensors()
         
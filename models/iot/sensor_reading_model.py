@@ -0,0 +1,173 @@
+from models.db import db
+from sqlalchemy import func, tuple_
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+ROLLUP_MINUTE = 60
+ROLLUP_HOUR = 3600
+ROLLUP_RESOLUTIONS = (ROLLUP_MINUTE, ROLLUP_HOUR)
+ROLLUP_LOOKUP_CHUNK = 300
+
+
+def bucket_start(timestamp, resolution):
+    if resolution == ROLLUP_HOUR:
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(second=0, microsecond=0)
+
+
+class SensorReading(db.Model):
+    __tablename__ = "sensor_readings"
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    sensor_id = db.Column(db.Integer, db.ForeignKey("sensors.id", ondelete="CASCADE"), nullable=False)
+    value = db.Column(db.Float, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    # More than ANOMALY_SIGMAS standard deviations from the sensor's running mean
+    anomaly = db.Column(db.Boolean, nullable=False, default=False, server_default="0")
+
+    __table_args__ = (
+        db.Index("ix_sensor_readings_sensor_timestamp", "sensor_id", "timestamp"),
+    )
+
+    def get_readings(sensor_id, start=None, end=None, limit=None):
+        query = SensorReading.query.filter(SensorReading.sensor_id == sensor_id)
+        if start is not None:
+            query = query.filter(SensorReading.timestamp >= start)
+        if end is not None:
+            query = query.filter(SensorReading.timestamp < end)
+        query = query.order_by(SensorReading.timestamp)
+        if limit is not None:
+            query = query.limit(limit)
+        return query.all()
+
+    def get_latest_readings(sensor_id, limit=10):
+        return (
+            SensorReading.query.filter(SensorReading.sensor_id == sensor_id)
+            .order_by(SensorReading.timestamp.desc())
+            .limit(limit)
+            .all()
+        )
+
+    def get_anomalies(sensor_id, limit=50):
+        return (
+            SensorReading.query.filter(SensorReading.sensor_id == sensor_id, SensorReading.anomaly.is_(True))
+            .order_by(SensorReading.timestamp.desc())
+            .limit(limit)
+            .all()
+        )
+
+
+class SensorRollup(db.Model):
+    __tablename__ = "sensor_rollups"
+    sensor_id = db.Column(db.Integer, db.ForeignKey("sensors.id", ondelete="CASCADE"), primary_key=True)
+    resolution = db.Column(db.Integer, primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    min_value = db.Column(db.Float, nullable=False)
+    max_value = db.Column(db.Float, nullable=False)
+    sum_value = db.Column(db.Float, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+
+    @property
+    def avg_value(self):
+        return self.sum_value / self.count if self.count else None
+
+    def get_rollups(sensor_id, resolution, start=None, end=None):
+        query = SensorRollup.query.filter(
+            SensorRollup.sensor_id == sensor_id,
+            SensorRollup.resolution == resolution,
+        )
+        if start is not None:
+            query = query.filter(SensorRollup.bucket_start >= start)
+        if end is not None:
+            query = query.filter(SensorRollup.bucket_start < end)
+        return query.order_by(SensorRollup.bucket_start).all()
+
+    def apply_readings(readings):
+        """Fold a batch of reading rows into the minute/hour rollups.
+
+        Runs inside the caller's transaction: the batch is aggregated in memory
+        first, so each touched bucket costs one row write. On SQLite, MySQL and
+        PostgreSQL that write is an upsert that adds to the stored bucket in the
+        database, so ingest processes flushing the same bucket at once do not
+        overwrite each other; other databases read the buckets and write them back.
+        """
+        aggregates = {}
+        for reading in readings:
+            value = reading["value"]
+            for resolution in ROLLUP_RESOLUTIONS:
+                key = (reading["sensor_id"], resolution, bucket_start(reading["timestamp"], resolution))
+                aggregate = aggregates.get(key)
+                if aggregate is None:
+                    aggregates[key] = [value, value, value, 1]
+                else:
+                    aggregate[0] = min(aggregate[0], value)
+                    aggregate[1] = max(aggregate[1], value)
+                    aggregate[2] += value
+                    aggregate[3] += 1
+        if not aggregates:
+            return
+        if SensorRollup.upsert_rollups(aggregates):
+            return
+
+        # Chunked: three bound parameters per key, and SQLite allows 999 per statement
+        keys = list(aggregates)
+        existing = []
+        for index in range(0, len(keys), ROLLUP_LOOKUP_CHUNK):
+            existing.extend(SensorRollup.query.filter(
+                tuple_(SensorRollup.sensor_id, SensorRollup.resolution, SensorRollup.bucket_start)
+                .in_(keys[index:index + ROLLUP_LOOKUP_CHUNK])
+            ).all())
+        for rollup in existing:
+            key = (rollup.sensor_id, rollup.resolution, rollup.bucket_start)
+            min_value, max_value, sum_value, count = aggregates.pop(key)
+            rollup.min_value = min(rollup.min_value, min_value)
+            rollup.max_value = max(rollup.max_value, max_value)
+            rollup.sum_value += sum_value
+            rollup.count += count
+
+        db.session.add_all([
+            SensorRollup(
+                sensor_id=sensor_id,
+                resolution=resolution,
+                bucket_start=start,
+                min_value=min_value,
+                max_value=max_value,
+                sum_value=sum_value,
+                count=count,
+            )
+            for (sensor_id, resolution, start), (min_value, max_value, sum_value, count) in aggregates.items()
+        ])
+
+    def upsert_rollups(aggregates):
+        """Add {(sensor_id, resolution, bucket_start): [min, max, sum, count]} with one upsert.
+
+        Returns False when the database has no upsert this knows how to build.
+        """
+        table = SensorRollup.__table__
+        dialect = db.session.get_bind().dialect.name
+        if dialect == "mysql":
+            statement = mysql.insert(table)
+            new, least, greatest = statement.inserted, func.least, func.greatest
+        elif dialect in ("sqlite", "postgresql"):
+            statement = (sqlite if dialect == "sqlite" else postgresql).insert(table)
+            new = statement.excluded
+            # SQLite's two-argument min()/max() are scalar, like LEAST/GREATEST
+            least, greatest = (func.min, func.max) if dialect == "sqlite" else (func.least, func.greatest)
+        else:
+            return False
+        changes = {
+            "min_value": least(table.c.min_value, new.min_value),
+            "max_value": greatest(table.c.max_value, new.max_value),
+            "sum_value": table.c.sum_value + new.sum_value,
+            "count": table.c.count + new.count,
+        }
+        if dialect == "mysql":
+            statement = statement.on_duplicate_key_update(**changes)
+        else:
+            statement = statement.on_conflict_do_update(
+                index_elements=[table.c.sensor_id, table.c.resolution, table.c.bucket_start], set_=changes,
+            )
+        db.session.execute(statement, [
+            {"sensor_id": sensor_id, "resolution": resolution, "bucket_start": start,
+             "min_value": min_value, "max_value": max_value, "sum_value": sum_value, "count": count}
+            for (sensor_id, resolution, start), (min_value, max_value, sum_value, count) in aggregates.items()
+        ])
+        return True
@@ -0,0 +1,163 @@
+// Keeps a client-side copy of the device data in sync with the server.
+// Changes are pushed through Server-Sent Events (/api/stream); polling of
+// /api/device_data is only used while the stream is unavailable, and then
+// asks only for the changes since the last version seen (?since=).
+const LIVE_HISTORY_LIMIT = 10;
+
+// Text shown for an actuator: the state its device confirmed, plus the
+// command still waiting for acknowledgement or the last one left unanswered.
+function actuatorStatusText(actuator) {
+    const state = actuator.state || "Desconhecido";
+    if (actuator.command_status === "pending") {
+        return `${state} (aguardando: ${actuator.pending_state})`;
+    }
+    if (actuator.command_status === "timeout") {
+        return `${state} (sem resposta)`;
+    }
+    return state;
+}
+
+// Liveness of the registered sensor publishing on `topic`, or null when unknown.
+const LIVENESS_LABELS = { online: "Online", stale: "Sem dados recentes", offline: "Offline" };
+
+function sensorLiveness(liveness, topic) {
+    return Object.values(liveness || {}).find(entry => entry.topic === topic) || null;
+}
+
+function livenessText(entry) {
+    if (!entry || !LIVENESS_LABELS[entry.status]) {
+        return "";
+    }
+    if (entry.status === "online" || !entry.last_seen) {
+        return LIVENESS_LABELS[entry.status];
+    }
+    return `${LIVENESS_LABELS[entry.status]} (visto em ${entry.last_seen})`;
+}
+
+function livenessClass(entry) {
+    if (!entry || entry.status === "online") {
+        return "text-green-600 dark:text-green-400";
+    }
+    return entry.status === "stale" ? "text-yellow-600 dark:text-yellow-400" : "text-red-600 dark:text-red-400";
+}
+
+// Running statistics of a sensor entry: mean ± standard deviation and trend.
+function sensorStatsText(sensor) {
+    const stats = sensor && sensor.stats;
+    if (!stats || stats.mean === null) {
+        return "";
+    }
+    let text = `Média ${stats.mean.toFixed(1)}`;
+    if (stats.std !== null) {
+        text += ` ± ${stats.std.toFixed(1)}`;
+    }
+    if (stats.rate_per_min !== null) {
+        text += ` · Tendência ${stats.rate_per_min >= 0 ? "+" : ""}${stats.rate_per_min.toFixed(2)}/min`;
+    }
+    return text;
+}
+
+function connectLiveUpdates(render, pollInterval = 5000) {
+    const state = { sensors: {}, actuators: {}, command_history: [], liveness: {}, version: null, epoch: null };
+    let pollTimer = null;
+
+    function applyVersion(version) {
+        if (version !== undefined && (state.version === null || version > state.version)) {
+            state.version = version;
+        }
+    }
+
+    function fetchData(full) {
+        let url = "/api/device_data";
+        if (!full && state.version !== null) {
+            url += `?since=${state.version}&epoch=${state.epoch}`;
+        }
+        return fetch(url)
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP error! status: ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(data => {
+                if (data.full) {
+                    state.sensors = data.sensors || {};
+                    state.actuators = data.actuators || {};
+                    state.command_history = data.command_history || [];
+                    state.liveness = data.liveness || {};
+                } else {
+                    Object.assign(state.sensors, data.sensors);
+                    Object.assign(state.actuators, data.actuators);
+                    Object.assign(state.liveness, data.liveness);
+                    state.command_history = state.command_history
+                        .concat(data.command_history || [])
+                        .slice(-LIVE_HISTORY_LIMIT);
+                }
+                state.epoch = data.epoch;
+                state.version = data.version;
+                render(state);
+            })
+            .catch(error => {
+                console.error("Error fetching device data:", error);
+                render(state, error);
+            });
+    }
+
+    const fetchSnapshot = () => fetchData(true);
+    const fetchChanges = () => fetchData(false);
+
+    function startPolling() {
+        if (!pollTimer) {
+            pollTimer = setInterval(fetchChanges, pollInterval);
+        }
+    }
+
+    function stopPolling() {
+        if (pollTimer) {
+            clearInterval(pollTimer);
+            pollTimer = null;
+        }
+    }
+
+    fetchSnapshot();
+
+    if (!window.EventSource) {
+        startPolling();
+        return { refresh: fetchSnapshot };
+    }
+
+    const source = new EventSource("/api/stream");
+    source.onopen = () => {
+        stopPolling();
+        fetchSnapshot(); // Resynchronize anything missed while disconnected
+    };
+    source.onerror = () => startPolling();
+
+    source.addEventListener("sensor", event => {
+        const sensor = JSON.parse(event.data);
+        state.sensors[sensor.key] = sensor;
+        applyVersion(sensor.version);
+        render(state);
+    });
+    source.addEventListener("actuator", event => {
+        const actuator = JSON.parse(event.data);
+        state.actuators[actuator.key] = actuator;
+        applyVersion(actuator.version);
+        render(state);
+    });
+    source.addEventListener("liveness", event => {
+        const entry = JSON.parse(event.data);
+        state.liveness[entry.sensor_id] = entry;
+        applyVersion(entry.version);
+        render(state);
+    });
+    source.addEventListener("command", event => {
+        const entry = JSON.parse(event.data);
+        state.command_history.push(entry);
+        applyVersion(entry.version);
+        state.command_history = state.command_history.slice(-LIVE_HISTORY_LIMIT);
+        render(state);
+    });
+
+    return { refresh: fetchSnapshot, source: source };
+}
@@ -0,0 +1,75 @@
+import datetime
+
+import pytest
+
+from app import create_app, create_schema
+from controllers.write_behind import WriteBehindBuffer
+from models.db import db
+from models.iot.sensor_model import Sensor
+from models.iot.sensor_reading_model import SensorReading
+
+
+@pytest.fixture
+def app():
+    app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite://"})
+    with app.app_context():
+        create_schema()
+    return app
+
+
+@pytest.fixture
+def sensor_id(app):
+    with app.app_context():
+        return Sensor.save_sensor("Temperatura", "iot/sensor/temperatura", "°C").id
+
+
+def make_buffer(app):
+    buffer = WriteBehindBuffer()
+    buffer.set_app(app)
+    return buffer
+
+
+def test_rejected_put_does_not_drop_valid_append(app, sensor_id):
+    buffer = make_buffer(app)
+    buffer.put(Sensor, sensor_id, {"name": None})
+    buffer.append(SensorReading, {"sensor_id": sensor_id, "value": 21.5, "timestamp": datetime.datetime.now()})
+
+    assert buffer.flush() == 1
+
+    stats = buffer.stats()
+    assert stats["dropped_rows"] == 1
+    assert stats["pending"] == 0
+    with app.app_context():
+        assert [reading.value for reading in SensorReading.query.all()] == [21.5]
+        assert db.session.get(Sensor, sensor_id).name == "Temperatura"
+
+
+def test_rejected_append_does_not_drop_valid_put(app, sensor_id):
+    buffer = make_buffer(app)
+    buffer.put(Sensor, sensor_id, {"value": 22.0})
+    buffer.append(SensorReading, {"sensor_id": sensor_id + 1, "value": 1.0, "timestamp": datetime.datetime.now()})
+
+    assert buffer.flush() == 1
+
+    assert buffer.stats()["dropped_rows"] == 1
+    with app.app_context():
+        assert db.session.get(Sensor, sensor_id).value == 22.0
+        assert SensorReading.query.count() == 0
+
+
+def test_flusher_thread_survives_errors(app):
+    buffer = make_buffer(app)
+    calls = []
+
+    def failing_flush():
+        calls.append(1)
+        buffer._running = len(calls) < 2
+        raise RuntimeError("boom")
+
+    buffer.flush = failing_flush
+    buffer._pending[(Sensor, 1)] = {"value": 1.0}
+    buffer._running = True
+    buffer.flush_interval = 0.01
+    buffer._run()
+
+    assert len(calls) == 2
@@ -0,0 +1,14 @@
+# WSGI entry point for production servers:
+#
+#   IOT_ROLE=web gunicorn -w 4 -k gthread --threads 32 wsgi:app
+#
+# Use threaded (gthread) or gevent workers: every open dashboard keeps an
+# /api/stream (SSE) response running, which would hold a default sync worker
+# for good and be killed by its 30 s timeout.
+#
+# Without --preload each worker imports this module after the fork, so every
+# process starts its own background threads exactly once.
+from app import create_app, start_services
+
+app = create_app()
+start_services(app)